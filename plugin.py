@@ -5,6 +5,7 @@
 #   * get the low batery state
 #   * get the valve position
 #   * set the active profile
+# Multiple thermostats can be handled by one plugin instance, refreshed with a single XML-API request.
 # Dependencies
 # Library ElementTree (https://docs.python.org/3/library/xml.etree.elementtree.html#)
 # NOTES:
@@ -16,9 +17,9 @@
 # Version: See plugin xml definition
 
 """
-<plugin key="HMIP-eTRV" name="homematicIP Radiator Thermostat (HmIP-eTRV)" author="rwbL" version="1.3.0 (Build 20210118)">
+<plugin key="HMIP-eTRV" name="homematicIP Radiator Thermostat (HmIP-eTRV)" author="rwbL" version="1.4.0 (Build 20261018)">
     <description>
-        <h2>homematicIP Radiator Thermostat (HMIP-eTRV) v1.3.0</h2>
+        <h2>homematicIP Radiator Thermostat (HMIP-eTRV) v1.4.0</h2>
         <ul style="list-style-type:square">
             <li>Set the setpoint (degrees C).</li>
             <li>Get the actual temperature (degrees C).</li>
@@ -26,6 +27,8 @@
             <li>Get the valve position (0 - 100%).</li>
             <li>Set the active profile.</li>
             <li>Supported are the devices HmIP-eTRV-B, HmIP-eTRV-2</li>
+            <li>Multiple thermostats per hardware instance, refreshed with one XML-API request.</li>
+            <li>Optional: boost mode, window state, valve state, operating voltage, humidity (constant DATAPOINTTYPESOPTIONAL).</li>
         </ul>
         <h2>Domoticz Devices (Type,SubType)</h2>
         <ul style="list-style-type:square">
@@ -40,16 +43,33 @@
             <li>Address (CCU IP address, default: 192.168.1.225)</li>
             <li>IDs (obtained via XML-API script http://ccu-ip-address/addons/xmlapi/statelist.cgi):</li>
             <ul style="list-style-type:square">
-                <li>Device ID HmIP-eTRV-B or HmIP-eTRV-2 (default: 1541)</li>
-                <li>Datapoint IDs(#5): SET_POINT_TEMPERATURE, ACTUAL_TEMPERATURE, LOW_BAT, LEVEL, ACTIVE_PROFILE as comma separated list in this order (defaults:1584,1567,1549,1576,1566)</li>
+                <li>Device ID(s) HmIP-eTRV-B or HmIP-eTRV-2 (default: 1541). Multiple thermostats as comma separated list, i.e. 1541,1602</li>
+                <li>Datapoint IDs(#5): SET_POINT_TEMPERATURE, ACTUAL_TEMPERATURE, LOW_BAT, LEVEL, ACTIVE_PROFILE as comma separated list in this order (defaults:1584,1567,1549,1576,1566). Multiple thermostats: one list per device ID separated by semicolon (;), in the same order as the device IDs</li>
+                <li>Leave the Datapoint IDs (or the list of a device ID) empty to discover the datapoints automatically. The discovered datapoints are cached in the plugin folder.</li>
             </ul>
+            <li>Transport: XML-API add-on (default) or the CCU JSON-RPC API (requires Username and Password of the CCU WebUI). With JSON-RPC the datapoints are resolved from the device IDs, the Datapoint IDs are not used.</li>
+            <li>Push Events (optional): the CCU sends changes of the datapoints to the plugin (XML-RPC, HmIP-RF interface). The check interval is then only used as safety resync (every 15 minutes).</li>
             <li>Note: After configuration update, the setpoint is 0. Click the setpoint to set the value.</li>
         </ul>
     </description>
     <params>
         <param field="Address" label="CCU IP" width="200px" required="true" default="192.168.1.225"/>
-        <param field="Mode1" label="Device ID" width="75px" required="true" default="1541"/>
-        <param field="Mode2" label="Datapoint IDs" width="200px" required="true" default="1584,1567,1549,1576,1566"/>
+        <param field="Mode1" label="Device IDs" width="200px" required="true" default="1541"/>
+        <param field="Mode2" label="Datapoint IDs" width="600px" required="false" default=""/>
+        <param field="Mode3" label="Transport" width="120px">
+            <options>
+                <option label="XML-API" value="XML-API" default="true"/>
+                <option label="JSON-RPC" value="JSON-RPC"/>
+            </options>
+        </param>
+        <param field="Username" label="Username (JSON-RPC)" width="150px" required="false" default=""/>
+        <param field="Password" label="Password (JSON-RPC)" width="150px" required="false" default="" password="true"/>
+        <param field="Mode4" label="Push Events" width="75px">
+            <options>
+                <option label="Off" value="Off" default="true"/>
+                <option label="On" value="On"/>
+            </options>
+        </param>
         <param field="Mode5" label="Check Interval (sec)" width="75px" required="true" default="60"/>
         <param field="Mode6" label="Debug" width="75px">
             <options>
@@ -62,73 +82,676 @@
 """
 
 # Set the plugin version
-PLUGINVERSION = "v1.3.0"
+PLUGINVERSION = "v1.4.0"
 PLUGINSHORTDESCRIPTON = "HmIP-eTRV"
 
 ## Imports
 import Domoticz
 import urllib
 import urllib.request
+import urllib.error
 from datetime import datetime
 import json
+import time
+import socket
+import os
+import tempfile
+import zlib
+import bisect
+import array
+import random
+import queue
+import concurrent.futures
+import xmlrpc.client
 import xml.etree.ElementTree as etree
+## fcntl is used to lock the shared rate limit file - not available on Windows, the rate limit is then disabled
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 ## Domoticz device units used for creating & updating devices
+## The units are relative to the unit block of a thermostat (see UNITSPERTHERMOSTAT)
 UNITSETPOINTTEMPERATURE = 1 # TypeName: N/A; Type ID:242 (Name:Thermostat); Subtype ID:1 (Name:Setpoint); Create device use Type=242, Subtype=1
 UNITACTUALTEMPERATURE = 2   # TypeName: Temperature
 UNITLOWBAT = 3              # TypeName: Alert
 UNITLEVEL = 4               # TypeName: Percentage
 UNITACTIVEPROFILE = 5       # TypeName: Selector Switch
 
-# Number of datapoints = must match number of index defined below
+# Optional datapoint devices of a thermostat (see DATAPOINTTYPESOPTIONAL)
+UNITBOOSTMODE = 6           # TypeName: Switch
+UNITWINDOWSTATE = 7         # TypeName: Contact
+UNITVALVESTATE = 8          # TypeName: Text
+UNITOPERATINGVOLTAGE = 9    # TypeName: Voltage
+UNITHUMIDITY = 10           # TypeName: Humidity
+
+# Optional history devices of a thermostat (see HISTORYDEVICES)
+UNITTEMPERATURESLOPE = 11   # TypeName: Custom Sensor (K/h)
+UNITVALVEDUTY = 12          # TypeName: Percentage
+UNITTIMETOSETPOINT = 13     # TypeName: Custom Sensor (min)
+
+# Number of units reserved per thermostat
+## Thermostat 1 uses the units 1-16, thermostat 2 the units 17-32 etc.
+## The units not used by the datapoints above are reserved for additional devices.
+## Domoticz supports max 255 units per hardware, means max 15 thermostats per plugin instance.
+UNITSPERTHERMOSTAT = 16
+MAXTHERMOSTATS = 15
+
+# Number of required datapoints = must match the number of DATAPOINTTYPES
 DATAPOINTS = 5
 
-# Index of the datapoints from the datapoints list
-# The datapoints are defined as a comma separated string in parameter Mode2
-# Syntax:DATAPOINTINDEX<Type> - without blanks or underscores; start with 0!
-DATAPOINTINDEXSETPOINTTEMPERATURE = 0
-DATAPOINTINDEXACTUALTEMPERATURE = 1
-DATAPOINTINDEXLOWBAT = 2
-DATAPOINTINDEXLEVEL = 3
-DATAPOINTINDEXACTIVEPROFILE = 4
+# Datapoint types in the order of the datapoints list - used to discover the datapoints of a device
+## The datapoints are defined as a comma separated string in parameter Mode2 in this order
+DATAPOINTTYPES = ["SET_POINT_TEMPERATURE", "ACTUAL_TEMPERATURE", "LOW_BAT", "LEVEL", "ACTIVE_PROFILE"]
+
+# Optional datapoint types monitored in addition to the DATAPOINTTYPES - Change as required
+## Supported: BOOST_MODE, WINDOW_STATE, VALVE_STATE, OPERATING_VOLTAGE, HUMIDITY, see DATAPOINTMAP.
+## The device must have all DATAPOINTTYPES - devices without valve (LEVEL), i.e. the wall thermostat HmIP-WTH, are not supported.
+## The datapoints follow the DATAPOINTTYPES in the datapoints list (parameter Mode2) in this order or are discovered.
+## A datapoint type not found for a device is not monitored. Example: ["BOOST_MODE", "WINDOW_STATE"]
+DATAPOINTTYPESOPTIONAL = []
+
+# File in the plugin folder (HomeFolder) to cache the discovered datapoints - the hardware id is added to enable multiple plugin instances
+DATAPOINTSCACHEFILE = "datapoints_{}.json"
 
 # Tasks to perform
-## Change the setpoint
-TASKSETPOINTTEMPERATURE = 1 
-## Get values from the datapoints ACTUAL_TEMPERATURE, LOW_BAT, LEVEL
+## Get the values of the datapoints of all thermostats (XML-API state.cgi) or of a channel (JSON-RPC Interface.getParamset)
 TASKGETDATAPOINTS = 2
-## Set the active profile
-TASKSETACTIVEPROFILE = 3
+## Change one or more datapoints with a single request (the setpoint, profile and boost mode changes)
+TASKSTATECHANGE = 4
+## JSON-RPC: login to get the session id and get the device address
+TASKLOGIN = 5
+TASKGETDEVICE = 6
+
+# Request priorities - the lower the value the higher the priority
+## JSON-RPC: the login is send before all other requests
+PRIORITYLOGIN = -1
+## User commands (setpoint, profile) are send before the datapoints requests
+PRIORITYCOMMAND = 0
+PRIORITYPOLL = 1
+
+# Max number of requests send without a response
+## With 1 request in flight, a command waits max for one pending datapoints request
+MAXREQUESTSINFLIGHT = 1
+## Timeout (seconds) for a request without response (checked with the heartbeat) - Change as required
+## The connection is closed, the requests are send again with the next connection and the timeout counts as failure of the circuit breaker.
+REQUESTTIMEOUT = 30
+
+# Debounce window (seconds) for the setpoint and profile changes - Change as required
+## Changes within the window are combined into one statechange request with the last value per datapoint.
+## During the window the heartbeat is set to 1 second. Set to 0 to send every change immediately.
+WRITEDEBOUNCE = 2
+
+# Adaptive check interval - Change as required
+## The check interval (parameter Mode5) is doubled up to POLLINTERVALMAX (seconds) while the actual temperature, valve level and setpoint do not change.
+## If one of these changes, the check interval is reset to Mode5. Set POLLINTERVALMAX to 0 to use the fixed check interval.
+POLLINTERVALMAX = 600
+## After a setpoint or profile change, CONFIRMPOLLS datapoints requests are send every CONFIRMPOLLINTERVAL seconds to confirm the new state.
+CONFIRMPOLLS = 3
+CONFIRMPOLLINTERVAL = 10
+## Tolerance (seconds) to check the time of the next request with the heartbeat
+SCHEDULETOLERANCE = 1
+
+# Push events via XML-RPC (parameter Mode4) - Change as required
+## The CCU HmIP-RF interface XML-RPC port. The plugin registers its callback server via the method init.
+CCURPCPORT = 2010
+## Timeout (seconds) to unregister the callback server when the plugin stops
+CCURPCTIMEOUT = 5
+## The callback server port is CALLBACKPORT + hardware id, to enable multiple plugin instances
+CALLBACKPORT = 9300
+## The callback address (IP address of the Domoticz server as seen by the CCU). Empty = determine automatically.
+CALLBACKADDRESS = ""
+## Interval (seconds) to request the datapoints and to renew the registration if push events are used
+PUSHRESYNCINTERVAL = 900
+
+# History of the datapoints per thermostat - Change as required
+## Each datapoints response adds a sample (time, actual temperature, setpoint, valve level) to a ring buffer of HISTORYSIZE samples covering max HISTORYWINDOW seconds.
+## The temperature slope (K/h), the valve duty (time weighted valve level) and the estimated time to reach the setpoint are computed incrementally.
+## Memory per thermostat: 6 arrays of HISTORYSIZE doubles (256 samples = 12 KB). The history is saved in the plugin folder when the plugin stops.
+HISTORYSIZE = 256
+HISTORYWINDOW = 3600
+HISTORYFILE = "history_{}.json"
+## Create the history devices (True) Temperature Slope, Valve Duty and Time To Setpoint per thermostat (units 11-13 of the thermostat unit block)
+HISTORYDEVICES = False
+
+# Snapshot of the last applied values - Change as required
+## The values of the thermostats, the datapoint timestamps and the digest of the last datapoints response are saved in the plugin folder
+## every SNAPSHOTINTERVAL seconds and when the plugin stops. At start the values are restored, the first datapoints response only updates the changed values.
+SNAPSHOTFILE = "snapshot_{}.json"
+SNAPSHOTINTERVAL = 900
+
+# Number of bytes fed at once to the XML parser
+PARSERCHUNKSIZE = 4096
+
+# Transport (parameter Mode3)
+## XML-API: the XML-API add-on (state.cgi, statechange.cgi) - one request for the datapoints of all thermostats
+## JSON-RPC: the CCU JSON-RPC API (/api/homematic.cgi) - login once (Session.login) and reuse the session,
+## get the device address (Device.get), the values per channel (Interface.getParamset) and set the values (Interface.setValue).
+## The datapoints are identified by name, i.e. HmIP-RF.000A18A9A64DAC:1.SET_POINT_TEMPERATURE
+TRANSPORTXMLAPI = "XML-API"
+TRANSPORTJSONRPC = "JSON-RPC"
+JSONRPCURL = "/api/homematic.cgi"
+## The channel of the datapoint types is defined in DATAPOINTMAP
+## A request failed because the session expired (JSON-RPC error message containing one of JSONRPCSESSIONERRORS, i.e. "access denied (session1234)")
+## is send again after a new login, max JSONRPCRETRIES times - Change as required. Other errors (i.e. unknown device) drop the request.
+JSONRPCRETRIES = 2
+JSONRPCSESSIONERRORS = ["access denied", "session"]
+
+# Circuit breaker for an unreachable CCU - Change as required
+## The breaker opens after BREAKERFAILURES consecutive failures (connection failed, response status not 200). While open, no requests are send.
+## After the backoff time a single probe (datapoints request) is send (half-open). If the probe succeeds, the breaker closes and the held commands are send.
+## If the probe fails, the breaker opens again with the doubled backoff time. The backoff time starts with BACKOFFMIN up to BACKOFFMAX seconds.
+## BACKOFFJITTER randomizes the backoff time (+/- 20%) to spread the probes of multiple plugin instances.
+BREAKERFAILURES = 3
+BACKOFFMIN = 30
+BACKOFFMAX = 900
+BACKOFFJITTER = 0.2
+## Circuit breaker states
+BREAKERCLOSED = "closed"
+BREAKEROPEN = "open"
+BREAKERHALFOPEN = "half-open"
+
+# Staggered and rate limited CCU access for multiple plugin instances - Change as required
+## The heartbeat of each plugin instance is shifted by a phase offset derived from the hardware id: (hardware id * PHASEOFFSETSTEP) modulo the heartbeat (60 s).
+## Plugin instances with consecutive hardware ids request the datapoints in different seconds. Set to 0 to disable.
+PHASEOFFSETSTEP = 7
+## Max requests per second (token bucket rate and burst) to the CCU from all plugin instances. Set RATELIMIT to 0 to disable.
+## The token bucket and the number of requests in flight per instance are shared via the file RATELIMITFILE, locked while read and written.
+## The file is updated twice per request and is kept in RATELIMITFOLDER in memory (tmpfs /dev/shm, else the temp folder), not on the SD card.
+RATELIMIT = 2
+RATELIMITBURST = 2
+RATELIMITFILE = "hmip-etrv-ratelimit.json"
+RATELIMITFOLDER = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+# Worker mode - Change as required
+## True: the datapoints are requested and parsed in a background thread (urllib), only the device updates are done in the plugin thread.
+## The commands (setpoint, profile) are not blocked by a slow CCU or a large XML-API response. False: all requests use the Domoticz connection.
+WORKERMODE = False
+## Number of worker threads and the request timeout (seconds) - the plugin waits max this timeout for the workers when stopping
+WORKERTHREADS = 1
+WORKERTIMEOUT = 10
+
+# Telemetry - Change as required
+## Upper bounds (milliseconds) of the histogram buckets for the connect, response and parse times. The last bucket counts the higher values.
+TELEMETRYBUCKETS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+## Interval (seconds) to write the telemetry file and to update the telemetry devices
+TELEMETRYINTERVAL = 300
+## File in the plugin folder (HomeFolder) with the telemetry snapshot - the hardware id is added to enable multiple plugin instances
+TELEMETRYFILE = "telemetry_{}.json"
+## Create telemetry devices (True) showing the average times of the last interval and the errors. The devices use the units 241-245.
+TELEMETRYDEVICES = False
+UNITTELEMETRYCONNECTTIME = 241  # TypeName: Custom Sensor (ms)
+UNITTELEMETRYRESPONSETIME = 242 # TypeName: Custom Sensor (ms)
+UNITTELEMETRYPARSETIME = 243    # TypeName: Custom Sensor (ms)
+UNITTELEMETRYRESPONSESIZE = 244 # TypeName: Custom Sensor (bytes)
+UNITTELEMETRYERRORS = 245       # TypeName: Text
 
 # User Messages - Change as required
 LOWBATMSGOK = "OK"
 LOWBATMSGNOK = "Niedrig"
+VALVESTATEMSG = ["Not available", "Run to start", "Wait for adaption", "Adaption in progress", "Adaption done", "Too tight", "Adjustment too big", "Adjustment too small", "Error position"]
 
-class BasePlugin:
+# Datapoint type to device mapping - drives the device creation, the device updates and the commands
+## Unit: unit of the thermostat unit block; Name: device name; Type, Subtype, Switchtype, Options: Domoticz device type
+## Channel: JSON-RPC channel of the datapoint - HmIP-eTRV: channel 0 (maintenance), channel 1 (heating)
+## Attribute: thermostat attribute with the last value applied - the device is only updated if the value changed
+## Convert: converts the XML-API value (string) to the attribute value; Device: returns the device (nValue, sValue) for the attribute value or None
+## Changed: a change adapts the check interval (see AdaptPollInterval)
+## Init: device (nValue, sValue) after creating the device
+## ValueType, Write: writeable datapoints - the JSON-RPC value type and returns the new value for the command and level or None
+DATAPOINTMAP = {
+    ## <datapoint name="HmIP-RF.000A18A9A64DAC:1.SET_POINT_TEMPERATURE" type="SET_POINT_TEMPERATURE" ise_id="1584" value="20.000000" valuetype="4" valueunit="" timestamp="1610965660"/>
+    "SET_POINT_TEMPERATURE": {"Unit": UNITSETPOINTTEMPERATURE, "Name": "Setpoint", "Type": 242, "Subtype": 1, "Channel": 1,
+                              "Attribute": "SetPoint", "Convert": float, "Device": lambda Value: (1, str(Value)), "Changed": True,
+                              "ValueType": "double", "Write": lambda Command, Level: Level},
+    "ACTUAL_TEMPERATURE": {"Unit": UNITACTUALTEMPERATURE, "Name": "Temperature", "Type": 80, "Subtype": 5, "Channel": 1,
+                           "Attribute": "Temperature", "Convert": float, "Device": lambda Value: (0, str(round(Value, 2))), "Changed": True},
+    ## Battery status: false=green (1), true=red (4)
+    "LOW_BAT": {"Unit": UNITLOWBAT, "Name": "Battery", "Type": 243, "Subtype": 22, "Channel": 0, "Init": (1, LOWBATMSGOK),
+                "Attribute": "LowBat", "Convert": str, "Device": lambda Value: (1, LOWBATMSGOK) if Value == "false" else (4, LOWBATMSGNOK) if Value == "true" else None, "Changed": False},
+    ## The value between 0 - 1 is converted to 0 - 100%
+    "LEVEL": {"Unit": UNITLEVEL, "Name": "Valve", "Type": 243, "Subtype": 6, "Channel": 1,
+              "Attribute": "Level", "Convert": lambda Value: float(Value) * 100, "Device": lambda Value: (0, str(round(Value, 0))), "Changed": True},
+    ## Active profile 1 - 3 is the selector level 10 - 30; the nvalue must be 2 to ensure the selector is on
+    "ACTIVE_PROFILE": {"Unit": UNITACTIVEPROFILE, "Name": "Profile", "Type": 244, "Subtype": 62, "Switchtype": 18, "Channel": 1,
+                       "Options": {"LevelActions": "|||", "LevelNames": "Off|1|2|3", "LevelOffHidden": "true", "SelectorStyle": "0"},
+                       "Attribute": "Profile", "Convert": int, "Device": lambda Value: (2, str(Value * 10)), "Changed": False,
+                       "ValueType": "int", "Write": lambda Command, Level: round(Level / 10) if Level > 0 else None},
+    "BOOST_MODE": {"Unit": UNITBOOSTMODE, "Name": "Boost", "Type": 244, "Subtype": 73, "Switchtype": 0, "Channel": 1,
+                   "Attribute": "BoostMode", "Convert": str, "Device": lambda Value: (1, "On") if Value == "true" else (0, "Off"), "Changed": False,
+                   "ValueType": "bool", "Write": lambda Command, Level: "true" if Command == "On" else "false"},
+    ## Window state: 0 = closed, 1 = open
+    "WINDOW_STATE": {"Unit": UNITWINDOWSTATE, "Name": "Window", "Type": 244, "Subtype": 73, "Switchtype": 2, "Channel": 1,
+                     "Attribute": "WindowState", "Convert": int, "Device": lambda Value: (1, "Open") if Value == 1 else (0, "Closed"), "Changed": False},
+    "VALVE_STATE": {"Unit": UNITVALVESTATE, "Name": "Valve State", "Type": 243, "Subtype": 19, "Channel": 1,
+                    "Attribute": "ValveState", "Convert": int, "Device": lambda Value: (0, VALVESTATEMSG[Value] if 0 <= Value < len(VALVESTATEMSG) else str(Value)), "Changed": False},
+    "OPERATING_VOLTAGE": {"Unit": UNITOPERATINGVOLTAGE, "Name": "Voltage", "Type": 243, "Subtype": 8, "Channel": 0,
+                          "Attribute": "Voltage", "Convert": float, "Device": lambda Value: (0, str(round(Value, 2))), "Changed": False},
+    ## Humidity: the nvalue is the humidity, the svalue the humidity status (0 = normal)
+    "HUMIDITY": {"Unit": UNITHUMIDITY, "Name": "Humidity", "Type": 81, "Subtype": 1, "Channel": 1,
+                 "Attribute": "Humidity", "Convert": lambda Value: int(float(Value)), "Device": lambda Value: (Value, "0"), "Changed": False},
+}
 
-    def __init__(self):
-        # HTTP Connection
-        self.httpConn = None
-        self.httpConnected = 0
-        
-        # List of datapoints (#4) - SET_POINT_TEMPERATURE, ACTUAL_TEMPERATURE, LOW_BAT, ACTIVE_PROFILE
-        self.DatapointsList = []
+class Thermostat:
 
-        # Task to complete - default is get the datapoints
-        self.Task = TASKGETDATAPOINTS
+    def __init__(self, Index, DeviceID, DatapointsList, DatapointsConfigured=True):
+        # Position of the thermostat in the device id list (parameter Mode1) - start with 0
+        self.Index = Index
+        # Device ID and the list of datapoints (#5) - SET_POINT_TEMPERATURE, ACTUAL_TEMPERATURE, LOW_BAT, LEVEL, ACTIVE_PROFILE
+        # followed by the optional datapoints (DATAPOINTTYPESOPTIONAL) - empty if the optional datapoint is not found
+        # The list is empty if the datapoints are not discovered yet
+        self.DeviceID = DeviceID
+        self.DatapointsList = DatapointsList
+        # Datapoint id to DATAPOINTMAP entry of the datapoints list - see UpdateDatapointIDs
+        self.Dispatch = {}
+        # True if the datapoints are defined in parameter Mode2, False if discovered (or cached)
+        self.DatapointsConfigured = DatapointsConfigured
+
+        # First unit of the thermostat unit block
+        self.UnitBase = Index * UNITSPERTHERMOSTAT
 
         # Thermostat Datapoints, i.e. Setpoint, LowBat, Temperature
-        self.SetPoint = 0       # setpoint in C 
+        # These are the last values applied to the devices - the devices are only updated if the value changed
+        self.SetPoint = None    # setpoint in C - init with None to get the initial value
         self.Temperature = 0    # actual temperature
         self.LowBat = "unknown" # low battery "true" or "false". init with unknown to get the initial value
         self.Level = 0          # valve position 0 - 100%
         self.Profile = 0        # active profile 1 - 3 - init with 0 to ensure getting the value ser first time
-               
+        # Optional datapoints - init with None to get the initial value
+        self.BoostMode = None   # boost mode "true" or "false"
+        self.WindowState = None # window state 0 (closed) or 1 (open)
+        self.ValveState = None  # valve state 0 - 8
+        self.Voltage = None     # operating voltage in V
+        self.Humidity = None    # humidity in %
+
+        # History of the actual temperature, setpoint and valve level
+        self.History = History(HISTORYSIZE, HISTORYWINDOW)
+        return
+
+    # Get the Domoticz unit for the thermostat unit, i.e. UNITLEVEL of the 2nd thermostat is unit 20
+    def Unit(self, Unit):
+        return self.UnitBase + Unit
+
+    # Get the Domoticz device name. The first thermostat keeps the plain names to be compatible with earlier versions.
+    def DeviceName(self, Name):
+        if self.Index == 0:
+            return Name
+        return Name + " " + self.DeviceID
+
+class History:
+
+    def __init__(self, Size, Window):
+        # Ring buffer of samples: index of the oldest sample and number of samples
+        self.Size = Size
+        self.Window = Window
+        self.Start = 0
+        self.Count = 0
+        self.Times = array.array('d', [0.0] * Size)
+        self.Temperatures = array.array('d', [0.0] * Size)
+        self.SetPoints = array.array('d', [0.0] * Size)
+        self.Levels = array.array('d', [0.0] * Size)
+        # Duration (seconds) from the sample to the next sample and the valve level times the duration
+        self.Durations = array.array('d', [0.0] * Size)
+        self.LevelAreas = array.array('d', [0.0] * Size)
+        # Running sums: least squares of the temperature over the time (hours since BaseTime) and the time weighted valve level
+        self.BaseTime = 0.0
+        self.SumT = 0.0
+        self.SumY = 0.0
+        self.SumTT = 0.0
+        self.SumTY = 0.0
+        self.SumDuration = 0.0
+        self.SumLevelArea = 0.0
+        return
+
+    # Add a sample - the samples older than the window and the oldest sample if the buffer is full are removed
+    def Add(self, Time, Temperature, SetPoint, Level):
+        while self.Count > 0 and (self.Count == self.Size or self.Times[self.Start] < Time - self.Window):
+            self.RemoveOldest()
+        if self.Count == 0:
+            self.BaseTime = Time
+        else:
+            Last = (self.Start + self.Count - 1) % self.Size
+            Duration = max(0.0, Time - self.Times[Last])
+            self.Durations[Last] = Duration
+            self.LevelAreas[Last] = self.Levels[Last] * Duration
+            self.SumDuration += Duration
+            self.SumLevelArea += self.LevelAreas[Last]
+        Index = (self.Start + self.Count) % self.Size
+        self.Times[Index] = Time
+        self.Temperatures[Index] = Temperature
+        self.SetPoints[Index] = SetPoint
+        self.Levels[Index] = Level
+        self.Durations[Index] = 0.0
+        self.LevelAreas[Index] = 0.0
+        T = (Time - self.BaseTime) / 3600
+        self.SumT += T
+        self.SumY += Temperature
+        self.SumTT += T * T
+        self.SumTY += T * Temperature
+        self.Count += 1
+        return
+
+    def RemoveOldest(self):
+        Index = self.Start
+        T = (self.Times[Index] - self.BaseTime) / 3600
+        self.SumT -= T
+        self.SumY -= self.Temperatures[Index]
+        self.SumTT -= T * T
+        self.SumTY -= T * self.Temperatures[Index]
+        self.SumDuration -= self.Durations[Index]
+        self.SumLevelArea -= self.LevelAreas[Index]
+        self.Start = (self.Start + 1) % self.Size
+        self.Count -= 1
+        if self.Count == 0:
+            ## reset the sums to avoid rounding drift
+            self.SumT = self.SumY = self.SumTT = self.SumTY = self.SumDuration = self.SumLevelArea = 0.0
+        return
+
+    # Temperature slope (K/h) - least squares over the samples
+    def Slope(self):
+        Divisor = self.Count * self.SumTT - self.SumT * self.SumT
+        if self.Count < 2 or Divisor <= 1e-9:
+            return 0.0
+        return (self.Count * self.SumTY - self.SumT * self.SumY) / Divisor
+
+    # Valve duty (%) - the valve level weighted by the duration
+    def ValveDuty(self):
+        if self.SumDuration <= 0:
+            return self.Levels[(self.Start + self.Count - 1) % self.Size] if self.Count > 0 else 0.0
+        return self.SumLevelArea / self.SumDuration
+
+    # Estimated time (minutes) to reach the setpoint from the temperature slope. 0 = reached, -1 = not reached with the actual slope.
+    def TimeToSetPoint(self):
+        if self.Count == 0:
+            return -1
+        Last = (self.Start + self.Count - 1) % self.Size
+        Difference = self.SetPoints[Last] - self.Temperatures[Last]
+        if Difference <= 0:
+            return 0
+        Slope = self.Slope()
+        if Slope <= 0:
+            return -1
+        return round(Difference / Slope * 60)
+
+    # The samples in time order as list of [time, temperature, setpoint, level] - used to save the history
+    def Samples(self):
+        Samples = []
+        for Offset in range(self.Count):
+            Index = (self.Start + Offset) % self.Size
+            Samples.append([self.Times[Index], self.Temperatures[Index], self.SetPoints[Index], self.Levels[Index]])
+        return Samples
+
+    # String for logging, i.e. samples: 42, slope: 0.35 K/h, valve duty: 23.5 %, time to setpoint: 12 min
+    def ToString(self):
+        return "samples: " + str(self.Count) + ", slope: " + str(round(self.Slope(), 2)) + " K/h, valve duty: " + str(round(self.ValveDuty(), 1)) + " %, time to setpoint: " + str(self.TimeToSetPoint()) + " min"
+
+class Request:
+
+    def __init__(self, Task, Priority, thermostat=None, Value=None):
+        # Task to perform, i.e. TASKGETDATAPOINTS, the priority and the thermostat and new value for the setpoint or profile tasks
+        self.Task = Task
+        self.Priority = Priority
+        self.Thermostat = thermostat
+        self.Value = Value
+        # Timestamps (seconds) when queued and when send
+        self.QueuedTime = time.time()
+        self.SentTime = 0
+        # Number of times the request was send again (JSON-RPC error)
+        self.Retries = 0
+        return
+
+class DatapointsResult:
+
+    def __init__(self):
+        # Result of a datapoints request done by a worker thread
+        ## HTTP status (0 if the request failed), error (connect, parse) with the error message, response time, response size and parse time
+        self.Status = 0
+        self.Error = ""
+        self.Message = ""
+        self.ResponseTime = 0.0
+        self.ResponseSize = 0
+        self.ParseTime = 0.0
+        # Digest of the response - the response is not parsed if the digest equals the digest of the last response
+        self.Digest = None
+        self.Skipped = False
+        # The parsed datapoints (discovered datapoints, values, timestamps, names) - see ParseDatapoints
+        self.Datapoints = None
+        return
+
+class CircuitBreaker:
+
+    def __init__(self):
+        # State closed (requests are send), open (requests are held) or half-open (a probe request is pending)
+        self.State = BREAKERCLOSED
+        # Number of consecutive failures, backoff time (seconds) and time to send the probe request
+        self.Failures = 0
+        self.Backoff = 0
+        self.RetryTime = 0
+        # Statistics: number of failures, number of times opened and number of probes
+        self.FailuresTotal = 0
+        self.Opened = 0
+        self.Probes = 0
+        return
+
+    # Count a failure. Returns True if the breaker has been opened.
+    def Failure(self):
+        self.Failures += 1
+        self.FailuresTotal += 1
+        if self.State == BREAKEROPEN:
+            return False
+        if self.State == BREAKERHALFOPEN:
+            self.Backoff = min(self.Backoff * 2, BACKOFFMAX)
+        elif self.Failures >= BREAKERFAILURES:
+            self.Backoff = BACKOFFMIN
+            self.Opened += 1
+        else:
+            return False
+        self.State = BREAKEROPEN
+        self.RetryTime = time.time() + self.Backoff * random.uniform(1 - BACKOFFJITTER, 1 + BACKOFFJITTER)
+        return True
+
+    # Reset the failures. Returns True if the breaker has been closed.
+    def Success(self):
+        self.Failures = 0
+        if self.State == BREAKERCLOSED:
+            return False
+        self.State = BREAKERCLOSED
+        self.Backoff = 0
+        return True
+
+    # Check if the backoff time has passed and start the probe
+    def StartProbe(self):
+        if self.State != BREAKEROPEN or time.time() < self.RetryTime:
+            return False
+        self.State = BREAKERHALFOPEN
+        self.Probes += 1
+        return True
+
+    # String for logging, i.e. Circuit breaker: open, failures: 3 (total 7), opened: 2, probes: 4, retry in 57 s
+    def ToString(self):
+        Text = "Circuit breaker: " + self.State + ", failures: " + str(self.Failures) + " (total " + str(self.FailuresTotal) + "), opened: " + str(self.Opened) + ", probes: " + str(self.Probes)
+        if self.State == BREAKEROPEN:
+            Text += ", retry in " + str(max(0, round(self.RetryTime - time.time()))) + " s"
+        return Text
+
+    # Dict for the telemetry file
+    def ToDict(self):
+        return {"state": self.State, "failures": self.Failures, "failurestotal": self.FailuresTotal, "opened": self.Opened, "probes": self.Probes, "backoff": self.Backoff}
+
+class Statistic:
+
+    def __init__(self):
+        # Number of values, sum and max value
+        self.Count = 0
+        self.Total = 0.0
+        self.Max = 0.0
+        # Number of values and sum at the end of the last interval (see IntervalAverage)
+        self.IntervalCount = 0
+        self.IntervalTotal = 0.0
+        return
+
+    def Add(self, Value):
+        self.Count += 1
+        self.Total += Value
+        if Value > self.Max:
+            self.Max = Value
+        return
+
+    def Average(self):
+        if self.Count == 0:
+            return 0.0
+        return self.Total / self.Count
+
+    # Average of the values added since the last call
+    def IntervalAverage(self):
+        Count = self.Count - self.IntervalCount
+        Total = self.Total - self.IntervalTotal
+        self.IntervalCount = self.Count
+        self.IntervalTotal = self.Total
+        if Count == 0:
+            return 0.0
+        return Total / Count
+
+    # String for logging, i.e. n=10, avg=0.012, max=0.150
+    def ToString(self):
+        return "n=" + str(self.Count) + ", avg=" + str(round(self.Average(), 3)) + ", max=" + str(round(self.Max, 3))
+
+    # Dict for the telemetry file
+    def ToDict(self):
+        return {"n": self.Count, "avg": round(self.Average(), 3), "max": round(self.Max, 3)}
+
+class Histogram(Statistic):
+
+    def __init__(self, Buckets):
+        super().__init__()
+        # Upper bounds of the buckets and the number of values per bucket - the last bucket counts the values above the last bound
+        self.Buckets = Buckets
+        self.BucketCounts = [0] * (len(Buckets) + 1)
+        return
+
+    def Add(self, Value):
+        super().Add(Value)
+        self.BucketCounts[bisect.bisect_left(self.Buckets, Value)] += 1
+        return
+
+    # Dict for the telemetry file, i.e. {"n": 10, "avg": 12.5, "max": 150.0, "buckets": {"<=10": 4, ..., ">5000": 0}}
+    def ToDict(self):
+        Dict = super().ToDict()
+        Dict["buckets"] = {}
+        for Index, Bound in enumerate(self.Buckets):
+            Dict["buckets"]["<=" + str(Bound)] = self.BucketCounts[Index]
+        Dict["buckets"][">" + str(self.Buckets[-1])] = self.BucketCounts[-1]
+        return Dict
+
+class BasePlugin:
+
+    def __init__(self):
+        # HTTP Connection - one persistent (keep-alive) connection to the CCU used for all requests
+        self.httpConn = None
+        self.httpConnected = 0
+        # Requests to send ordered by priority and requests send waiting for the response (in send order)
+        self.RequestQueue = []
+        self.RequestsInFlight = []
+        # Statistics: number of connections opened vs number of requests send
+        self.ConnectionsOpened = 0
+        self.RequestsSent = 0
+        # Statistics: max queue depth, datapoints requests dropped as already pending, wait time in queue and command latency (seconds)
+        self.QueueDepthMax = 0
+        self.PollsDropped = 0
+        self.CommandWaitTime = Statistic()
+        self.PollWaitTime = Statistic()
+        self.CommandLatency = Statistic()
+
+        # Push events (XML-RPC): the callback server listening for the CCU events and the connection to register the callback server
+        self.PushEvents = False
+        self.rpcListener = None
+        self.rpcConn = None
+        self.rpcInterfaceID = ""
+        self.rpcCallbackURL = ""
+        # Method to send to the CCU after connecting, i.e. init
+        self.rpcRequest = None
+        # Datapoint names as used by the CCU events, i.e. HmIP-RF.000A18A9A64DAC:1.ACTUAL_TEMPERATURE, with the ise_id - set from the XML-API state response
+        self.DatapointNames = {}
+        # Digest of the last datapoints response and the timestamp per datapoint ise_id of the last datapoints response
+        ## An identical response is not parsed, a datapoint with unchanged timestamp is not applied
+        self.ResponseDigest = None
+        self.DatapointTimestamps = {}
+        # Statistics: number of datapoints responses skipped as identical and datapoints skipped as unchanged
+        self.ResponsesSkipped = 0
+        self.DatapointsSkipped = 0
+
+        # Telemetry: connect time, response time (request send to response received), parse time (milliseconds), response size (bytes)
+        ## device updates applied and errors by HTTP status (connect = connection failed, parse = response can not be parsed)
+        self.ConnectStartTime = 0
+        self.ConnectTime = Histogram(TELEMETRYBUCKETS)
+        self.ResponseTime = Histogram(TELEMETRYBUCKETS)
+        self.ParseTime = Histogram(TELEMETRYBUCKETS)
+        self.ResponseSize = Statistic()
+        self.DeviceUpdates = 0
+        self.Errors = {}
+        self.NextTelemetryTime = 0
+        self.NextSnapshotTime = 0
+
+        # Transport XML-API or JSON-RPC and the JSON-RPC session id
+        self.Transport = TRANSPORTXMLAPI
+        self.SessionID = ""
+        # JSON-RPC: flag if a value changed by the paramset responses of the pending datapoints requests
+        self.PollChanged = False
+
+        # Phase offset (seconds) of the heartbeat and flag if requests are waiting for a token of the shared rate limit
+        self.PhaseOffset = 0
+        self.RateLimited = False
+        # Statistics: number of requests delayed by the rate limit and peak number of concurrent requests of all plugin instances to the CCU
+        self.RequestsRateLimited = 0
+        self.PeakRequestsInFlight = 0
+
+        # Circuit breaker for the CCU requests
+        self.Breaker = CircuitBreaker()
+
+        # Worker mode: the worker threads, the results to process in the plugin thread and the flag if a datapoints request is pending
+        self.Executor = None
+        self.WorkerResults = queue.Queue()
+        self.WorkerPending = False
+
+        # Statistics: number of events received and events applied
+        self.EventsReceived = 0
+        self.EventsApplied = 0
+
+        # Setpoint and profile changes waiting for the debounce window to pass
+        ## Key datapoint ise_id, value (thermostat, new value) - the last change per datapoint wins
+        self.PendingWrites = {}
+        self.WriteDueTime = 0
+        # Statistics: number of datapoint changes sent vs suppressed (replaced by a later change in the debounce window)
+        self.WritesSent = 0
+        self.WritesSuppressed = 0
+        
+        # List of thermostats - one for each device id defined in parameter Mode1
+        self.Thermostats = []
+        # Datapoint types monitored in the order of the datapoints list - DATAPOINTTYPES followed by DATAPOINTTYPESOPTIONAL
+        self.DatapointTypes = DATAPOINTTYPES
+        # Set of the datapoint ids of all thermostats to get from the XML-API state response
+        self.DatapointIDs = set()
+        # Discovered datapoints cache: key device id, value datapoints list
+        self.DatapointsCache = {}
+        # Startup statistics: start time and flag if the first valid state is logged
+        self.StartTime = 0
+        self.FirstStateLogged = False
+
         # The Domoticz heartbeat is set to every 60 seconds. Do not use a higher value as Domoticz message "Error: hardware (N) thread seems to have ended unexpectedly"
-        # The plugin heartbeat is set in Parameter.Mode5 (seconds). This is determined by using a hearbeatcounter which is triggered by:
-        # (self.HeartbeatCounter * self.HeartbeatInterval) % int(Parameter.Mode5) = 0
+        # While changes are waiting for the debounce window, the heartbeat is set to 1 second.
+        # The plugin heartbeat is set in Parameter.Mode5 (seconds). The datapoints are requested with the first heartbeat at or after NextPollTime (time.time()).
+        # While confirmation requests are pending, the heartbeat is set to CONFIRMPOLLINTERVAL.
         self.HeartbeatInterval = 60
+        self.Heartbeat = self.HeartbeatInterval
         self.HeartbeatCounter = 0
+        self.NextPollTime = 0
+        # Effective check interval (seconds) - adapted to the change rate of the datapoints
+        self.PollInterval = 60
+        # Number of confirmation requests pending after a setpoint or profile change
+        self.ConfirmPolls = 0
+        # Statistics: datapoints requests send vs saved compared to the fixed check interval
+        self.Polls = 0
+        self.PollsSaved = 0.0
         return
 
     def onStart(self):
@@ -141,275 +764,1302 @@ class BasePlugin:
             Domoticz.Debugging(1)
             DumpConfigToLog()
 
-        # if there no devices, create these
+        self.StartTime = time.time()
+
+        # Create the thermostats using the device ids as defined in parameter Mode1 and the datapoints as defined in the parameter Mode2
+        ## Mode1 contains one or more device ids separated by comma (,).
+        ## Mode2 contains for each device id a list of datapoints separated by comma (,). The lists are separated by semicolon (;).
+        ## If the list of a device id is empty, the datapoints are taken from the cache or discovered from the first XML-API state response.
+        DeviceIDsParam = Parameters["Mode1"]
+        DatapointsParam = Parameters["Mode2"]
+        Domoticz.Debug("Device IDs:" + DeviceIDsParam)
+        Domoticz.Debug("Datapoints:" + DatapointsParam)
+        DeviceIDs = [DeviceID.strip() for DeviceID in DeviceIDsParam.split(',')]
+        DatapointsLists = DatapointsParam.split(';')
+        if len(DeviceIDs) > MAXTHERMOSTATS:
+            Domoticz.Error("[ERROR] Device IDs parameter not correct! Max number of thermostats is " + str(MAXTHERMOSTATS) + ".")
+            DeviceIDs = DeviceIDs[:MAXTHERMOSTATS]
+        self.DatapointsCache = self.LoadDatapointsCache()
+        self.Thermostats = []
+        ## The datapoint types monitored - the required types followed by the supported optional types
+        for DatapointType in DATAPOINTTYPESOPTIONAL:
+            if DatapointType not in DATAPOINTMAP:
+                Domoticz.Error("[ERROR] Optional datapoint type " + DatapointType + " not supported.")
+        self.DatapointTypes = DATAPOINTTYPES + [DatapointType for DatapointType in DATAPOINTTYPESOPTIONAL if DatapointType in DATAPOINTMAP and DatapointType not in DATAPOINTTYPES]
+        ## JSON-RPC: the datapoint names are resolved from the device address (Device.get), Mode2 and the cache are not used
+        self.Transport = TRANSPORTJSONRPC if Parameters["Mode3"] == TRANSPORTJSONRPC else TRANSPORTXMLAPI
+        Domoticz.Debug("Transport: " + self.Transport)
+        for Index, DeviceID in enumerate(DeviceIDs):
+            DatapointsList = []
+            if self.Transport == TRANSPORTJSONRPC:
+                self.Thermostats.append(Thermostat(Index, DeviceID, [], False))
+                continue
+            if Index < len(DatapointsLists) and DatapointsLists[Index].strip():
+                ## Split the parameter string into a list of datapoints
+                DatapointsList = [Datapoint.strip() for Datapoint in DatapointsLists[Index].split(',')]
+                # Check the list length against the constant DATAPOINTS
+                if len(DatapointsList) < DATAPOINTS:
+                    Domoticz.Error("[ERROR] Datapoints parameter not correct for device " + DeviceID + "! Number of datapoints should be " + str(DATAPOINTS) + ". Discovering the datapoints.")
+                    DatapointsList = []
+            if DatapointsList:
+                self.Thermostats.append(Thermostat(Index, DeviceID, DatapointsList))
+                continue
+            ## The cached datapoints are discovered again if a datapoint type is not in the cache (i.e. an optional datapoint type was added)
+            DatapointsByType = self.DatapointsCache.get(DeviceID, {})
+            if isinstance(DatapointsByType, dict) and all(DatapointType in DatapointsByType for DatapointType in self.DatapointTypes):
+                DatapointsList = [DatapointsByType[DatapointType] for DatapointType in self.DatapointTypes]
+            self.Thermostats.append(Thermostat(Index, DeviceID, DatapointsList, False))
+        self.UpdateDatapointIDs()
+
+        # Create the devices which do not exist
+        ## The snapshot is only restored for the thermostats with existing devices - new devices get the values with the first datapoints response
         Domoticz.Debug("Devices:" + str(len(Devices)) )
-        if (len(Devices) == 0):
+        ExistingDeviceIDs = [thermostat.DeviceID for thermostat in self.Thermostats if thermostat.Unit(UNITSETPOINTTEMPERATURE) in Devices]
+        for thermostat in self.Thermostats:
+            self.CreateDevices(thermostat)
+        self.LoadSnapshot(ExistingDeviceIDs)
+
+        if TELEMETRYDEVICES:
+            self.CreateTelemetryDevices()
+        if HISTORYDEVICES:
+            for thermostat in self.Thermostats:
+                self.CreateHistoryDevices(thermostat)
+        self.LoadHistory()
+
+        # Worker mode - start the worker threads to request and parse the datapoints
+        if WORKERMODE and self.Transport == TRANSPORTJSONRPC:
+            Domoticz.Log("Worker mode is not supported with transport JSON-RPC.")
+        elif WORKERMODE:
+            self.Executor = concurrent.futures.ThreadPoolExecutor(max_workers=WORKERTHREADS)
+
+        # Create the HTTP connection - connected with the first request and kept open
+        self.httpConn = Domoticz.Connection(Name="CCU-"+Parameters["Address"], Transport="TCP/IP", Protocol="HTTP", Address=Parameters["Address"], Port="80")
+
+        # Push events - start the callback server and register it with the CCU
+        if Parameters["Mode4"] == "On":
+            self.StartPushEvents()
+
+        # Heartbeat - the first heartbeat is delayed by the phase offset to spread the requests of multiple plugin instances
+        Domoticz.Debug("Heartbeat set: "+Parameters["Mode5"])
+        self.PhaseOffset = (int(Parameters["HardwareID"]) * PHASEOFFSETSTEP) % self.HeartbeatInterval
+        Domoticz.Debug("Phase offset: " + str(self.PhaseOffset))
+        self.Heartbeat = self.PhaseOffset if self.PhaseOffset > 0 else self.HeartbeatInterval
+        Domoticz.Heartbeat(self.Heartbeat)
+        # Reset the requests in flight of this instance in the shared rate limit (i.e. after a crash)
+        self.UpdateSharedRateLimit(0)
+
+        # Request the datapoints to get the actual state - delayed by the phase offset (with the first heartbeat)
+        self.PollInterval = int(Parameters["Mode5"])
+        self.NextTelemetryTime = time.time() + TELEMETRYINTERVAL
+        self.NextSnapshotTime = time.time() + SNAPSHOTINTERVAL
+        if self.PhaseOffset > 0:
+            self.NextPollTime = time.time() + self.PhaseOffset
+        else:
+            self.Poll()
+
+        DatapointsPending = len([thermostat for thermostat in self.Thermostats if not thermostat.DatapointsList])
+        Domoticz.Log("Startup: " + str(len(self.Thermostats)) + " thermostats, datapoints to discover: " + str(DatapointsPending) + ", onStart " + str(round((time.time() - self.StartTime) * 1000)) + " ms")
+        return
+
+    # Set the datapoint ids to get from the XML-API state response from the datapoints of all thermostats
+    # and the dispatch of each thermostat from the datapoint id to the DATAPOINTMAP entry of the datapoint type
+    def UpdateDatapointIDs(self):
+        self.DatapointIDs = set()
+        for thermostat in self.Thermostats:
+            thermostat.Dispatch = {}
+            for DatapointID, DatapointType in zip(thermostat.DatapointsList, self.DatapointTypes):
+                if DatapointID:
+                    thermostat.Dispatch[DatapointID] = DATAPOINTMAP[DatapointType]
+            self.DatapointIDs.update(thermostat.Dispatch.keys())
+        return
+
+    # Get the file name of the discovered datapoints cache
+    def GetDatapointsCacheFile(self):
+        return Parameters["HomeFolder"] + DATAPOINTSCACHEFILE.format(Parameters["HardwareID"])
+
+    # Load the discovered datapoints from the cache file. Returns an empty dict if there is no cache file.
+    ## File content example: {"1541": {"SET_POINT_TEMPERATURE": "1584", "ACTUAL_TEMPERATURE": "1567", "LOW_BAT": "1549", "LEVEL": "1576", "ACTIVE_PROFILE": "1566", "HUMIDITY": ""}}
+    ## The datapoints are cached by type - optional datapoint types not found are empty
+    def LoadDatapointsCache(self):
+        try:
+            with open(self.GetDatapointsCacheFile(), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            Domoticz.Error("[ERROR] Datapoints cache can not be read: " + str(e))
+            return {}
+
+    def SaveDatapointsCache(self):
+        try:
+            with open(self.GetDatapointsCacheFile(), "w") as f:
+                json.dump(self.DatapointsCache, f)
+        except Exception as e:
+            Domoticz.Error("[ERROR] Datapoints cache can not be written: " + str(e))
+        return
+
+    # Get the device ids of the thermostats without datapoints
+    def GetDiscoverDeviceIDs(self):
+        return set([thermostat.DeviceID for thermostat in self.Thermostats if not thermostat.DatapointsList])
+
+    # Set the discovered datapoints of the thermostats without datapoints
+    # The datapoints of the device are selected by type (DATAPOINTTYPES, DATAPOINTTYPESOPTIONAL) from the XML-API state response (see ParseDatapoints) and cached
+    def DiscoverDatapoints(self, DeviceDatapoints):
+        for thermostat in self.Thermostats:
+            if thermostat.DatapointsList:
+                continue
+            DatapointTypes = DeviceDatapoints.get(thermostat.DeviceID, {})
+            if not all(DatapointType in DatapointTypes for DatapointType in DATAPOINTTYPES):
+                Domoticz.Error("[ERROR] Datapoints can not be discovered for device " + thermostat.DeviceID + ". Found: " + str(DatapointTypes))
+                continue
+            thermostat.DatapointsList = [DatapointTypes.get(DatapointType, "") for DatapointType in self.DatapointTypes]
+            self.DatapointsCache[thermostat.DeviceID] = dict(zip(self.DatapointTypes, thermostat.DatapointsList))
+            Domoticz.Log("Datapoints discovered for device " + thermostat.DeviceID + ": " + ','.join(thermostat.DatapointsList))
+            self.CreateDevices(thermostat)
+        self.UpdateDatapointIDs()
+        self.SaveDatapointsCache()
+        return
+
+    # Invalidate the discovered datapoints of a thermostat - the datapoints are discovered again with the next XML-API state response
+    def InvalidateDatapoints(self, thermostat):
+        Domoticz.Log("Datapoints cache invalidated for device " + thermostat.DeviceID + ".")
+        thermostat.DatapointsList = []
+        self.DatapointsCache.pop(thermostat.DeviceID, None)
+        self.SaveDatapointsCache()
+        self.UpdateDatapointIDs()
+        self.ResponseDigest = None
+        return
+
+    # Get the interval (seconds) to request the datapoints
+    # If push events are used, the datapoints are only requested as safety resync
+    def GetPollInterval(self):
+        if self.PushEvents:
+            return max(int(Parameters["Mode5"]), PUSHRESYNCINTERVAL)
+        return self.PollInterval
+
+    # Request the datapoints and set the time for the next request
+    def Poll(self):
+        self.Polls += 1
+        self.NextPollTime = time.time() + self.GetPollInterval()
+        if self.Breaker.State == BREAKEROPEN:
+            Domoticz.Debug("Circuit breaker open. Datapoints request skipped.")
+            return
+        if self.Executor is not None:
+            self.SubmitPoll()
+        else:
+            self.SendRequest(TASKGETDATAPOINTS)
+        return
+
+    # Worker mode: request and parse the datapoints in a worker thread - the result is processed in the plugin thread by ProcessWorkerResults
+    # While the request is pending, the heartbeat is set to 1 second to process the result
+    def SubmitPoll(self):
+        if self.WorkerPending:
+            self.PollsDropped += 1
+            Domoticz.Debug("Datapoints request already pending. Dropped.")
+            return
+        if not self.AcquireRequest():
+            ## Request the datapoints with the next heartbeat
+            self.NextPollTime = time.time()
+            return
+        url = "http://" + Parameters["Address"] + self.GetURL(TASKGETDATAPOINTS, None, None)
+        Domoticz.Debug("Worker: " + url)
+        ## The response is not skipped by the digest if datapoints are to be discovered
+        DiscoverDeviceIDs = self.GetDiscoverDeviceIDs()
+        self.Executor.submit(FetchDatapoints, url, set(self.DatapointIDs), DiscoverDeviceIDs, list(self.DatapointTypes), None if DiscoverDeviceIDs else self.ResponseDigest, self.WorkerResults)
+        self.WorkerPending = True
+        self.RequestsSent += 1
+        self.UpdateHeartbeat()
+        return
+
+    # Worker mode: process the results of the worker threads - called from the Domoticz callbacks
+    def ProcessWorkerResults(self):
+        while True:
             try:
-                Domoticz.Debug("Creating new devices ...")
-                
-                ## 1 - SET_POINT_TEMPERATURE - TypeName: Thermostat (Type=242, Subtype=1)
-                Domoticz.Device(Name="Setpoint", Unit=UNITSETPOINTTEMPERATURE, Type=242, Subtype=1, Used=1).Create()
-                Domoticz.Debug("Device created: "+Devices[UNITSETPOINTTEMPERATURE].Name)
-
-                ## 2 - ACTUAL_TEMPERATURE - TypeName: Temperature (Type=80, Subtype=5)
-                Domoticz.Device(Name="Temperature", Unit=UNITACTUALTEMPERATURE, Type=80, Subtype=5, Used=1).Create()
-                Domoticz.Debug("Device created: "+Devices[UNITACTUALTEMPERATURE].Name)
-
-                ## 3 - LOW_BAT - TypeName: Alert (Type=243, Subtype=22)
-                Domoticz.Device(Name="Battery", Unit=UNITLOWBAT, Type=243, Subtype=22, Used=1).Create()
-                Devices[UNITLOWBAT].Update( nValue=1, sValue=LOWBATMSGOK )
-                Domoticz.Debug("Device created: "+Devices[UNITLOWBAT].Name)
-
-                ## 4 - LEVEL - TypeName: Percentage (Type=243, Subtype=6)
-                Domoticz.Device(Name="Valve", Unit=UNITLEVEL, Type=243, Subtype=6, Used=1).Create()
-                Domoticz.Debug("Device created: "+Devices[UNITLEVEL].Name)
-
-                ## 5 - ACTIVE_PROFILE - TypeName: Selector Switch (Type=244, Subtype=62)
-                SelectorSwitchOptions = {"LevelActions": "|||",
-                      "LevelNames": "Off|1|2|3",
-                      "LevelOffHidden": "true",
-                      "SelectorStyle": "0"}
-                Domoticz.Device(Name="Profile", Unit=UNITACTIVEPROFILE, Type=244, Subtype=62, Switchtype=18, Options=SelectorSwitchOptions, Used=1).Create()            
-
-                Domoticz.Debug("Creating new devices: OK")
-            except:
-                Domoticz.Error("[ERROR] Creating new devices: Failed. Check settings if new hardware allowed")
+                result = self.WorkerResults.get_nowait()
+            except queue.Empty:
+                break
+            self.WorkerPending = False
+            self.ReleaseRequests(1)
+            self.ResponseTime.Add(result.ResponseTime * 1000)
+            self.ResponseSize.Add(result.ResponseSize)
+            if result.Error in ("connect", "timeout"):
+                self.AddError(result.Error)
+                Domoticz.Error("[ERROR] Worker datapoints request failed: " + result.Message)
+                self.BreakerFailure()
+            elif result.Status != 200:
+                self.AddError(result.Status)
+                Domoticz.Error("[ERROR] XML-API response: " + str(result.Status))
+                self.BreakerFailure()
+            elif result.Error != "":
+                self.AddError(result.Error)
+                Domoticz.Error("[ERROR] XML-API response can not be parsed: " + result.Message)
+                self.BreakerSuccess()
+            elif result.Skipped:
+                self.BreakerSuccess()
+                self.SkipDatapoints()
+            else:
+                self.BreakerSuccess()
+                self.ParseTime.Add(result.ParseTime * 1000)
+                self.ResponseDigest = result.Digest
+                self.ApplyDatapoints(*result.Datapoints)
+            self.UpdateHeartbeat()
+        return
+
+    # Adapt the check interval after the datapoints response
+    # If the actual temperature, valve level or setpoint changed (the valve is moving), use the check interval as set in Mode5
+    # If not changed, double the check interval up to POLLINTERVALMAX
+    def AdaptPollInterval(self, Changed):
+        PollIntervalMin = int(Parameters["Mode5"])
+        if Changed or POLLINTERVALMAX <= PollIntervalMin:
+            self.PollInterval = PollIntervalMin
+        else:
+            self.PollInterval = min(self.PollInterval * 2, POLLINTERVALMAX)
+        if self.ConfirmPolls > 0:
+            self.ConfirmPolls -= 1
+        if self.ConfirmPolls > 0:
+            self.NextPollTime = time.time() + CONFIRMPOLLINTERVAL
         else:
-            # NOT USED - if there are devices, go for sure and update options. Exampe selector switch
-            # Options = { "LevelActions": "", "LevelNames": Parameters["Mode3"], "LevelOffHidden": "false", "SelectorStyle": "0" }
-            Domoticz.Debug("Devices already created.")
+            self.NextPollTime = time.time() + self.GetPollInterval()
+            if not self.PushEvents:
+                ## the number of requests the fixed check interval would have send in addition
+                self.PollsSaved += (self.PollInterval - PollIntervalMin) / PollIntervalMin
+        self.UpdateHeartbeat()
+        Domoticz.Debug("Poll interval: " + str(self.GetPollInterval()) + " (Polls: " + str(self.Polls) + ", Polls saved: " + str(int(self.PollsSaved)) + ")")
+        return
 
-        # Heartbeat
-        Domoticz.Debug("Heartbeat set: "+Parameters["Mode5"])
-        Domoticz.Heartbeat(self.HeartbeatInterval)
-        
-        # Create the datapoints list using the datapoints as defined in the parameter Mode2
-        ## The string contains multiple datapoints separated by comma (,). This enables to define more devices.
-        DatapointsParam = Parameters["Mode2"]
-        Domoticz.Debug("Datapoints:" + DatapointsParam)
-        ## Split the parameter string into a list of datapoints
-        self.DatapointsList = DatapointsParam.split(',')
-        # Check the list length against the constant DATAPOINTS
-        if len(self.DatapointsList) < DATAPOINTS:
-            Domoticz.Error("[ERROR] Datapoints parameter not correct! Number of datapoints should be " + DATAPOINTS + ".")
+    # Start the XML-RPC callback server for the CCU events and register it with the CCU HmIP-RF interface
+    def StartPushEvents(self):
+        try:
+            CallbackAddress = CALLBACKADDRESS
+            if not CallbackAddress:
+                ## Get the local IP address used to reach the CCU (no data is send)
+                s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                s.connect((Parameters["Address"], CCURPCPORT))
+                CallbackAddress = s.getsockname()[0]
+                s.close()
+            CallbackPort = CALLBACKPORT + int(Parameters["HardwareID"])
+            self.rpcCallbackURL = "http://" + CallbackAddress + ":" + str(CallbackPort)
+            self.rpcInterfaceID = "hmip-etrv-" + Parameters["HardwareID"]
+            self.rpcListener = Domoticz.Connection(Name="RPC-Listener", Transport="TCP/IP", Protocol="HTTP", Port=str(CallbackPort))
+            self.rpcListener.Listen()
+            self.rpcConn = Domoticz.Connection(Name="RPC-"+Parameters["Address"], Transport="TCP/IP", Protocol="HTTP", Address=Parameters["Address"], Port=str(CCURPCPORT))
+            self.PushEvents = True
+            Domoticz.Log("Push events: callback server " + self.rpcCallbackURL + ", interface id " + self.rpcInterfaceID)
+            self.SendRPCRequest("init", (self.rpcCallbackURL, self.rpcInterfaceID))
+        except Exception as e:
+            self.PushEvents = False
+            Domoticz.Error("[ERROR] Push events can not be started: " + str(e) + ". Using the check interval.")
+        return
+
+    # Send a XML-RPC request to the CCU, i.e. init to register or unregister (empty interface id) the callback server
+    def SendRPCRequest(self, Method, Params):
+        self.rpcRequest = xmlrpc.client.dumps(Params, Method)
+        if self.rpcConn.Connected():
+            self.SendRPCRequestData()
+        elif not self.rpcConn.Connecting():
+            self.rpcConn.Connect()
+        return
+
+    def SendRPCRequestData(self):
+        sendData = { 'Verb' : 'POST',
+                     'URL'  : '/',
+                     'Headers' : { 'Content-Type': 'text/xml', \
+                                   'Host': Parameters["Address"] + ":" + str(CCURPCPORT), \
+                                   'User-Agent':'Domoticz/1.0' },
+                     'Data' : self.rpcRequest
+                   }
+        self.rpcConn.Send(sendData)
+        self.rpcRequest = None
+        return
+
+    # Unregister the callback server - init with empty interface id
+    ## The request is send blocking (max CCURPCTIMEOUT seconds): the plugin stops after onStop, a request via the Domoticz connection would not be send anymore
+    def StopPushEvents(self):
+        try:
+            Data = xmlrpc.client.dumps((self.rpcCallbackURL, ""), "init").encode()
+            rpcRequest = urllib.request.Request("http://" + Parameters["Address"] + ":" + str(CCURPCPORT) + "/", data=Data, headers={"Content-Type": "text/xml"})
+            with urllib.request.urlopen(rpcRequest, timeout=CCURPCTIMEOUT) as response:
+                Domoticz.Debug("RPC unregister response: " + str(response.status))
+        except Exception as e:
+            Domoticz.Error("[ERROR] Callback server can not be unregistered: " + str(e))
+        if self.rpcConn.Connected() or self.rpcConn.Connecting():
+            self.rpcConn.Disconnect()
+        return
+
+    # Handle a XML-RPC request from the CCU received by the callback server and send the response
+    ## The CCU calls: system.listMethods, listDevices, newDevices, event and system.multicall with a list of events
+    def HandleRPCRequest(self, Connection, Data):
+        try:
+            Params, Method = xmlrpc.client.loads(bytes(Data.get("Data", b"")))
+            Domoticz.Debug("RPC request: " + str(Method))
+            Result = self.HandleRPCMethod(Method, Params)
+            ResponseData = xmlrpc.client.dumps((Result,), methodresponse=True)
+        except Exception as e:
+            Domoticz.Error("[ERROR] RPC request can not be handled: " + str(e))
+            ResponseData = xmlrpc.client.dumps(xmlrpc.client.Fault(1, str(e)))
+        Connection.Send({ 'Status' : '200 OK',
+                          'Headers' : { 'Content-Type': 'text/xml' },
+                          'Data' : ResponseData })
+        return
+
+    def HandleRPCMethod(self, Method, Params):
+        if Method == "system.multicall":
+            return [[self.HandleRPCMethod(Call["methodName"], Call["params"])] for Call in Params[0]]
+        if Method == "event":
+            ## event(interface_id, address, value_key, value), i.e. ("hmip-etrv-7", "000A18A9A64DAC:1", "ACTUAL_TEMPERATURE", 21.1)
+            self.ApplyEvent(Params[1], Params[2], Params[3])
+            return ""
+        if Method == "system.listMethods":
+            return ["system.listMethods", "system.multicall", "event", "listDevices", "newDevices", "deleteDevices", "updateDevice"]
+        if Method == "listDevices":
+            return []
+        return ""
+
+    # Update the device for the datapoint of the event
+    ## The datapoint ise_id is obtained from the datapoint name, i.e. HmIP-RF.000A18A9A64DAC:1.ACTUAL_TEMPERATURE
+    def ApplyEvent(self, Address, ValueKey, Value):
+        self.EventsReceived += 1
+        DatapointID = self.DatapointNames.get("HmIP-RF." + Address + "." + ValueKey)
+        if DatapointID is None:
+            return
+        ## Convert the value to the XML-API value format, i.e. true/false
+        if isinstance(Value, bool):
+            Value = "true" if Value else "false"
+        values = {DatapointID: str(Value)}
+        Domoticz.Debug("Event: " + Address + "." + ValueKey + "=" + str(Value))
+        for thermostat in self.Thermostats:
+            if DatapointID in thermostat.Dispatch:
+                try:
+                    self.UpdateThermostat(values, thermostat)
+                    self.EventsApplied += 1
+                except:
+                    Domoticz.Error("[ERROR] Event value can not be converted: " + Address + "." + ValueKey + "=" + str(Value))
+        return
+
+    # Create the devices of a thermostat which are not created yet - one device per datapoint type (see DATAPOINTMAP)
+    # The devices of the optional datapoint types are created when the datapoint is found (Mode2, discovered or JSON-RPC values)
+    def CreateDevices(self, thermostat):
+        try:
+            for Index, DatapointType in enumerate(self.DatapointTypes):
+                if Index >= DATAPOINTS and not (Index < len(thermostat.DatapointsList) and thermostat.DatapointsList[Index]):
+                    continue
+                Mapping = DATAPOINTMAP[DatapointType]
+                Unit = thermostat.Unit(Mapping["Unit"])
+                if Unit in Devices:
+                    continue
+                Domoticz.Device(Name=thermostat.DeviceName(Mapping["Name"]), Unit=Unit, Type=Mapping["Type"], Subtype=Mapping["Subtype"],
+                                Switchtype=Mapping.get("Switchtype", 0), Options=Mapping.get("Options", {}), Used=1).Create()
+                if "Init" in Mapping:
+                    Devices[Unit].Update(nValue=Mapping["Init"][0], sValue=Mapping["Init"][1])
+                Domoticz.Debug("Device created: " + Devices[Unit].Name)
+        except:
+            Domoticz.Error("[ERROR] Creating new devices: Failed. Check settings if new hardware allowed")
+        return
+
+    # Create the history devices of a thermostat which are not created yet
+    def CreateHistoryDevices(self, thermostat):
+        try:
+            if thermostat.Unit(UNITTEMPERATURESLOPE) not in Devices:
+                ## TypeName: Custom Sensor (Type=243, Subtype=31)
+                Domoticz.Device(Name=thermostat.DeviceName("Temperature Slope"), Unit=thermostat.Unit(UNITTEMPERATURESLOPE), Type=243, Subtype=31, Options={"Custom": "1;K/h"}, Used=1).Create()
+            if thermostat.Unit(UNITVALVEDUTY) not in Devices:
+                ## TypeName: Percentage (Type=243, Subtype=6)
+                Domoticz.Device(Name=thermostat.DeviceName("Valve Duty"), Unit=thermostat.Unit(UNITVALVEDUTY), Type=243, Subtype=6, Used=1).Create()
+            if thermostat.Unit(UNITTIMETOSETPOINT) not in Devices:
+                Domoticz.Device(Name=thermostat.DeviceName("Time To Setpoint"), Unit=thermostat.Unit(UNITTIMETOSETPOINT), Type=243, Subtype=31, Options={"Custom": "1;min"}, Used=1).Create()
+        except:
+            Domoticz.Error("[ERROR] Creating history devices: Failed. Check settings if new hardware allowed")
+        return
 
+    # Add a sample with the actual values of each thermostat to the history - called for each datapoints response
+    def AddHistorySamples(self):
+        Now = time.time()
+        for thermostat in self.Thermostats:
+            if not thermostat.DatapointsList or thermostat.SetPoint is None:
+                continue
+            thermostat.History.Add(Now, thermostat.Temperature, thermostat.SetPoint, thermostat.Level)
+            if HISTORYDEVICES:
+                for Unit, Value in [(UNITTEMPERATURESLOPE, round(thermostat.History.Slope(), 2)), (UNITVALVEDUTY, round(thermostat.History.ValveDuty(), 1)), (UNITTIMETOSETPOINT, thermostat.History.TimeToSetPoint())]:
+                    if thermostat.Unit(Unit) in Devices and Devices[thermostat.Unit(Unit)].sValue != str(Value):
+                        self.UpdateDevice(thermostat.Unit(Unit), 0, str(Value))
         return
 
+    # Get the file name of the snapshot
+    def GetSnapshotFile(self):
+        return Parameters["HomeFolder"] + SNAPSHOTFILE.format(Parameters["HardwareID"])
+
+    # Save the last applied values of the thermostats, the datapoint timestamps and the digest of the last datapoints response
+    # The datapoints of the thermostats are saved to check that the timestamps and the digest belong to the same datapoints
+    ## File content example: {"thermostats": {"1541": {"SET_POINT_TEMPERATURE": 20.0, "ACTUAL_TEMPERATURE": 21.1, "LOW_BAT": "false", "LEVEL": 15.0, "ACTIVE_PROFILE": 1}},
+    ## "datapoints": {"1541": ["1584", "1567", "1544", "1571", "1564"]}, "timestamps": {"1584": "1576315780", ...}, "digest": 123456789}
+    def SaveSnapshot(self):
+        Snapshot = {"thermostats": {}, "datapoints": {}, "timestamps": self.DatapointTimestamps, "digest": self.ResponseDigest}
+        for thermostat in self.Thermostats:
+            Snapshot["thermostats"][thermostat.DeviceID] = {DatapointType: getattr(thermostat, DATAPOINTMAP[DatapointType]["Attribute"]) for DatapointType in self.DatapointTypes}
+            Snapshot["datapoints"][thermostat.DeviceID] = thermostat.DatapointsList
+        try:
+            with open(self.GetSnapshotFile(), "w") as f:
+                json.dump(Snapshot, f)
+        except Exception as e:
+            Domoticz.Error("[ERROR] Snapshot can not be written: " + str(e))
+        return
+
+    # Restore the last applied values of the thermostats with existing devices
+    def LoadSnapshot(self, DeviceIDs):
+        try:
+            with open(self.GetSnapshotFile(), "r") as f:
+                Snapshot = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            Domoticz.Error("[ERROR] Snapshot can not be read: " + str(e))
+            return
+        Restored = 0
+        for thermostat in self.Thermostats:
+            Values = Snapshot.get("thermostats", {}).get(thermostat.DeviceID)
+            if Values is None or thermostat.DeviceID not in DeviceIDs or any(DatapointType not in Values for DatapointType in self.DatapointTypes):
+                continue
+            for DatapointType in self.DatapointTypes:
+                setattr(thermostat, DATAPOINTMAP[DatapointType]["Attribute"], Values[DatapointType])
+            Restored += 1
+        ## The timestamps and the digest are only valid if all thermostats are restored with the same datapoints (i.e. not after correcting Mode2)
+        ## and no thermostat waits for the discovery of its datapoints (the first response must be parsed)
+        Datapoints = Snapshot.get("datapoints", {})
+        if Restored == len(self.Thermostats) and not self.GetDiscoverDeviceIDs() and all(Datapoints.get(thermostat.DeviceID) == thermostat.DatapointsList for thermostat in self.Thermostats):
+            self.DatapointTimestamps = Snapshot.get("timestamps", {})
+            self.ResponseDigest = Snapshot.get("digest")
+        Domoticz.Log("Snapshot restored for " + str(Restored) + " of " + str(len(self.Thermostats)) + " thermostats.")
+        return
+
+    # Get the file name of the history
+    def GetHistoryFile(self):
+        return Parameters["HomeFolder"] + HISTORYFILE.format(Parameters["HardwareID"])
+
+    # Load the history saved when the plugin stopped
+    ## File content example: {"1541": [[1760000000.0, 21.1, 20.0, 15.0], ...]}
+    def LoadHistory(self):
+        try:
+            with open(self.GetHistoryFile(), "r") as f:
+                Histories = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            Domoticz.Error("[ERROR] History can not be read: " + str(e))
+            return
+        for thermostat in self.Thermostats:
+            for Sample in Histories.get(thermostat.DeviceID, []):
+                thermostat.History.Add(*Sample)
+        return
+
+    def SaveHistory(self):
+        try:
+            with open(self.GetHistoryFile(), "w") as f:
+                json.dump({thermostat.DeviceID: thermostat.History.Samples() for thermostat in self.Thermostats}, f)
+        except Exception as e:
+            Domoticz.Error("[ERROR] History can not be written: " + str(e))
+        return
+
+    # Create the telemetry devices which are not created yet
+    def CreateTelemetryDevices(self):
+        try:
+            for Unit, Name, Unitname in [(UNITTELEMETRYCONNECTTIME, "CCU Connect Time", "ms"), (UNITTELEMETRYRESPONSETIME, "CCU Response Time", "ms"), (UNITTELEMETRYPARSETIME, "CCU Parse Time", "ms"), (UNITTELEMETRYRESPONSESIZE, "CCU Response Size", "bytes")]:
+                if Unit not in Devices:
+                    ## TypeName: Custom Sensor (Type=243, Subtype=31) with the axis label as option
+                    Domoticz.Device(Name=Name, Unit=Unit, Type=243, Subtype=31, Options={"Custom": "1;" + Unitname}, Used=1).Create()
+            if UNITTELEMETRYERRORS not in Devices:
+                ## TypeName: Text (Type=243, Subtype=19)
+                Domoticz.Device(Name="CCU Errors", Unit=UNITTELEMETRYERRORS, Type=243, Subtype=19, Used=1).Create()
+        except:
+            Domoticz.Error("[ERROR] Creating telemetry devices: Failed. Check settings if new hardware allowed")
+        return
+
+    # Update a device and count the update
+    def UpdateDevice(self, Unit, nValue, sValue):
+        Devices[Unit].Update(nValue=nValue, sValue=sValue)
+        self.DeviceUpdates += 1
+        return
+
+    # Count an error by HTTP status or error type
+    def AddError(self, Status):
+        self.Errors[str(Status)] = self.Errors.get(str(Status), 0) + 1
+        return
+
+    # Write the telemetry file and update the telemetry devices with the average values since the last update
+    def PublishTelemetry(self):
+        Telemetry = {"time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                     "hardwareid": Parameters["HardwareID"],
+                     "address": Parameters["Address"],
+                     "deviceids": [thermostat.DeviceID for thermostat in self.Thermostats],
+                     "connectionsopened": self.ConnectionsOpened,
+                     "requestssent": self.RequestsSent,
+                     "polls": self.Polls,
+                     "pollinterval": self.GetPollInterval(),
+                     "responsesskipped": self.ResponsesSkipped,
+                     "deviceupdates": self.DeviceUpdates,
+                     "errors": self.Errors,
+                     "connecttime": self.ConnectTime.ToDict(),
+                     "responsetime": self.ResponseTime.ToDict(),
+                     "parsetime": self.ParseTime.ToDict(),
+                     "responsesize": self.ResponseSize.ToDict(),
+                     "commandlatency": self.CommandLatency.ToDict(),
+                     "breaker": self.Breaker.ToDict(),
+                     "requestsratelimited": self.RequestsRateLimited,
+                     "peakrequestsinflight": self.PeakRequestsInFlight}
+        try:
+            with open(Parameters["HomeFolder"] + TELEMETRYFILE.format(Parameters["HardwareID"]), "w") as f:
+                json.dump(Telemetry, f, indent=1)
+        except Exception as e:
+            Domoticz.Error("[ERROR] Telemetry file can not be written: " + str(e))
+        if TELEMETRYDEVICES:
+            for Unit, statistic in [(UNITTELEMETRYCONNECTTIME, self.ConnectTime), (UNITTELEMETRYRESPONSETIME, self.ResponseTime), (UNITTELEMETRYPARSETIME, self.ParseTime), (UNITTELEMETRYRESPONSESIZE, self.ResponseSize)]:
+                if Unit in Devices:
+                    Devices[Unit].Update(nValue=0, sValue=str(round(statistic.IntervalAverage(), 1)))
+            if UNITTELEMETRYERRORS in Devices:
+                Errors = ", ".join([Status + ": " + str(Count) for Status, Count in sorted(self.Errors.items())])
+                Devices[UNITTELEMETRYERRORS].Update(nValue=0, sValue=Errors if Errors else "None")
+        return
+
+    # Get the thermostat for a Domoticz unit
+    def GetThermostat(self, Unit):
+        Index = (Unit - 1) // UNITSPERTHERMOSTAT
+        for thermostat in self.Thermostats:
+            if thermostat.Index == Index:
+                return thermostat
+        return None
+
     def onStop(self):
+        Domoticz.Log("Connections opened: " + str(self.ConnectionsOpened) + ", Requests sent: " + str(self.RequestsSent))
+        self.LogSchedulerStatistics(Domoticz.Log)
+        Domoticz.Log("Writes sent: " + str(self.WritesSent) + ", Writes suppressed: " + str(self.WritesSuppressed))
+        Domoticz.Log("Poll interval: " + str(self.GetPollInterval()) + ", Polls: " + str(self.Polls) + ", Polls saved: " + str(int(self.PollsSaved)))
+        Domoticz.Log("Responses skipped: " + str(self.ResponsesSkipped) + ", Datapoints skipped: " + str(self.DatapointsSkipped))
+        Domoticz.Log(self.Breaker.ToString())
+        for thermostat in self.Thermostats:
+            Domoticz.Log("History " + thermostat.DeviceID + ": " + thermostat.History.ToString())
+        self.SaveHistory()
+        self.SaveSnapshot()
+        Domoticz.Log("Phase offset: " + str(self.PhaseOffset) + " s, Requests rate limited: " + str(self.RequestsRateLimited) + ", Peak concurrent CCU requests (all instances, since start): " + str(self.PeakRequestsInFlight))
+        Domoticz.Log("Response time: " + self.ResponseTime.ToString() + "; Parse time: " + self.ParseTime.ToString() + "; Device updates: " + str(self.DeviceUpdates) + ", Errors: " + str(self.Errors))
+        self.PublishTelemetry()
+        if self.httpConn is not None and (self.httpConn.Connected() or self.httpConn.Connecting()):
+            ## JSON-RPC: close the session
+            if self.SessionID and self.httpConn.Connected():
+                self.httpConn.Send(self.GetSendData(Request(TASKLOGIN, PRIORITYLOGIN, None, "logout")))
+            self.httpConn.Disconnect()
+        self.UpdateSharedRateLimit(0)
+        if self.Executor is not None:
+            ## Wait for the worker threads to end - max WORKERTIMEOUT seconds
+            self.Executor.shutdown(wait=True)
+            self.Executor = None
+        if self.PushEvents:
+            Domoticz.Log("Events received: " + str(self.EventsReceived) + ", Events applied: " + str(self.EventsApplied))
+            self.StopPushEvents()
         Domoticz.Debug("Plugin is stopping.")
 
-    # Send the url parameter (GET request)
-    # If task = actualtemperature then to obtain device state information in xml format
-    # If task = setpoint then set the setpoint usig switch using the self.switchstate
-    # The http response is parsed in onMessage()
+    # Queue a request for the task and send it over the persistent connection
+    # Commands are queued before datapoints requests. A datapoints request is dropped if one is already queued or in flight.
+    # If not connected, connect first - the queued requests are send in onConnect
+    def SendRequest(self, Task, thermostat=None, Value=None):
+        if self.Transport == TRANSPORTJSONRPC:
+            self.QueueLogin()
+        if Task == TASKGETDATAPOINTS:
+            if any(request.Task in (TASKGETDATAPOINTS, TASKGETDEVICE) for request in self.RequestQueue + self.RequestsInFlight):
+                self.PollsDropped += 1
+                Domoticz.Debug("Datapoints request already pending. Dropped.")
+            elif self.Transport == TRANSPORTJSONRPC:
+                self.QueueJSONRPCPoll()
+            else:
+                self.QueueRequest(Request(Task, PRIORITYPOLL))
+        elif self.Transport == TRANSPORTJSONRPC:
+            ## JSON-RPC: one Interface.setValue request per datapoint
+            for DatapointID, Change in Value.items():
+                self.QueueRequest(Request(Task, PRIORITYCOMMAND, thermostat, {DatapointID: Change}))
+        else:
+            self.QueueRequest(Request(Task, PRIORITYCOMMAND, thermostat, Value))
+        if self.Breaker.State == BREAKEROPEN:
+            Domoticz.Debug("Circuit breaker open. Request held (Queue depth: " + str(len(self.RequestQueue)) + ").")
+            return
+        if self.httpConn.Connected():
+            self.SendQueuedRequests()
+        elif not self.httpConn.Connecting():
+            self.Connect()
+        return
+
+    # JSON-RPC: queue the requests to get the datapoints of all thermostats
+    ## Get the device address of the thermostats without datapoints and the values of each channel
+    def QueueJSONRPCPoll(self):
+        for thermostat in self.Thermostats:
+            if thermostat.DatapointsList:
+                self.QueueParamsetRequests(thermostat)
+            else:
+                self.QueueRequest(Request(TASKGETDEVICE, PRIORITYPOLL, thermostat))
+        return
+
+    # JSON-RPC: queue the login if there is no session and no login pending
+    def QueueLogin(self):
+        if self.SessionID or any(request.Task == TASKLOGIN for request in self.RequestQueue + self.RequestsInFlight):
+            return
+        self.QueueRequest(Request(TASKLOGIN, PRIORITYLOGIN))
+        return
+
+    # JSON-RPC: queue one Interface.getParamset request per channel of the thermostat - the value is the channel, i.e. HmIP-RF.000A18A9A64DAC:1
+    def QueueParamsetRequests(self, thermostat):
+        for Channel in sorted(set([DatapointName.rsplit('.', 1)[0] for DatapointName in thermostat.DatapointsList if DatapointName])):
+            self.QueueRequest(Request(TASKGETDATAPOINTS, PRIORITYPOLL, thermostat, Channel))
+        return
+
+    # Count a failed request - if the breaker opens, the requests are held until the probe request succeeds
+    def BreakerFailure(self):
+        if self.Breaker.Failure():
+            Domoticz.Error("[ERROR] CCU not reachable. " + self.Breaker.ToString())
+        else:
+            Domoticz.Debug(self.Breaker.ToString())
+        return
+
+    # Count a successful request - if the breaker closes, the held requests are send
+    def BreakerSuccess(self):
+        if self.Breaker.Success():
+            Domoticz.Log("CCU reachable. " + self.Breaker.ToString() + ". Held requests: " + str(len(self.RequestQueue) + len(self.PendingWrites)))
+            if self.RequestQueue:
+                if self.httpConn.Connected():
+                    self.SendQueuedRequests()
+                elif not self.httpConn.Connecting():
+                    self.Connect()
+        return
+
+    # Open the connection to the CCU
+    def Connect(self):
+        self.ConnectStartTime = time.time()
+        self.httpConn.Connect()
+        self.ConnectionsOpened += 1
+        return
+
+    # Insert the request after the queued requests with the same or higher priority
+    def QueueRequest(self, request):
+        position = len(self.RequestQueue)
+        while position > 0 and self.RequestQueue[position - 1].Priority > request.Priority:
+            position -= 1
+        self.RequestQueue.insert(position, request)
+        self.QueueDepthMax = max(self.QueueDepthMax, len(self.RequestQueue))
+        return
+
+    # Send the queued requests (pipelined, max MAXREQUESTSINFLIGHT) - the responses are handled in onMessage in the same order
+    # If the circuit breaker is open, the requests are held. If half-open, only the probe (datapoints request) is send.
+    def SendQueuedRequests(self):
+        while self.RequestQueue and len(self.RequestsInFlight) < MAXREQUESTSINFLIGHT:
+            if self.Breaker.State == BREAKEROPEN:
+                return
+            if self.Breaker.State == BREAKERHALFOPEN:
+                Probes = [request for request in self.RequestQueue if request.Task in (TASKGETDATAPOINTS, TASKLOGIN)]
+                if self.RequestsInFlight or not Probes:
+                    return
+                request = Probes[0]
+            else:
+                request = self.RequestQueue[0]
+            # JSON-RPC: wait for the login response
+            if self.Transport == TRANSPORTJSONRPC and not self.SessionID and request.Task != TASKLOGIN:
+                return
+            # Wait for a token of the shared rate limit - the request is send with the next heartbeat
+            if not self.AcquireRequest():
+                return
+            self.RequestQueue.remove(request)
+            # Send the data and keep the connection open
+            self.httpConn.Send(self.GetSendData(request))
+            request.SentTime = time.time()
+            if request.Priority == PRIORITYCOMMAND:
+                self.CommandWaitTime.Add(request.SentTime - request.QueuedTime)
+            else:
+                self.PollWaitTime.Add(request.SentTime - request.QueuedTime)
+            self.RequestsInFlight.append(request)
+            self.RequestsSent += 1
+        return
+
+    # Take a token of the shared rate limit for a request. If no token is available, the heartbeat is set to 1 second to try again.
+    def AcquireRequest(self):
+        if self.UpdateSharedRateLimit(1):
+            return True
+        if not self.RateLimited:
+            self.RequestsRateLimited += 1
+            self.RateLimited = True
+            Domoticz.Debug("Rate limit reached. Request delayed.")
+            self.UpdateHeartbeat()
+        return False
+
+    # Queue the requests without response again - these are send first with the next connection
+    def RequeueRequestsInFlight(self):
+        self.ReleaseRequests(len(self.RequestsInFlight))
+        for request in reversed(self.RequestsInFlight):
+            self.RequestQueue.insert(0, request)
+        self.RequestsInFlight = []
+        return
+
+    # The CCU accepted the connection but did not respond within REQUESTTIMEOUT: close the connection and queue the requests again
+    def CheckRequestTimeout(self):
+        if not self.RequestsInFlight or time.time() - self.RequestsInFlight[0].SentTime < REQUESTTIMEOUT:
+            return
+        self.AddError("timeout")
+        Domoticz.Error("[ERROR] No response from the CCU within " + str(REQUESTTIMEOUT) + " seconds. Requests without response: " + str(len(self.RequestsInFlight)) + ".")
+        self.RequeueRequestsInFlight()
+        self.httpConnected = 0
+        self.httpConn.Disconnect()
+        self.BreakerFailure()
+        return
+
+    # The requests are done (response received or connection lost)
+    def ReleaseRequests(self, Count):
+        if Count > 0:
+            self.UpdateSharedRateLimit(-Count)
+        return
+
+    # Update the shared rate limit of all plugin instances using the same CCU (Address)
+    ## Change = 1: take a token and count the request in flight. Returns False if no token is available.
+    ## Change < 0: the number of requests done. Change = 0: reset the requests in flight of this instance.
+    ## File content example: {"192.168.1.225": {"tokens": 1.5, "time": 1760000000.0, "inflight": {"7": 1, "8": 0}}}
+    def UpdateSharedRateLimit(self, Change):
+        if RATELIMIT <= 0 or fcntl is None:
+            return True
+        Acquired = True
+        try:
+            with open(os.path.join(RATELIMITFOLDER, RATELIMITFILE), "a+") as f:
+                ## The lock is released when the file is closed
+                fcntl.flock(f, fcntl.LOCK_EX)
+                f.seek(0)
+                Content = f.read()
+                State = json.loads(Content) if Content else {}
+                CCU = State.setdefault(Parameters["Address"], {"tokens": RATELIMITBURST, "time": 0, "inflight": {}})
+                InFlight = CCU["inflight"].get(Parameters["HardwareID"], 0)
+                if Change > 0:
+                    ## Refill the tokens since the last update
+                    Now = time.time()
+                    CCU["tokens"] = min(RATELIMITBURST, CCU["tokens"] + (Now - CCU["time"]) * RATELIMIT)
+                    CCU["time"] = Now
+                    if CCU["tokens"] >= 1:
+                        CCU["tokens"] -= 1
+                        InFlight += 1
+                    else:
+                        Acquired = False
+                elif Change < 0:
+                    InFlight = max(0, InFlight + Change)
+                else:
+                    InFlight = 0
+                CCU["inflight"][Parameters["HardwareID"]] = InFlight
+                ## The peak since the start of this plugin instance
+                self.PeakRequestsInFlight = max(self.PeakRequestsInFlight, sum(CCU["inflight"].values()))
+                f.seek(0)
+                f.truncate()
+                json.dump(State, f)
+        except Exception as e:
+            Domoticz.Error("[ERROR] Rate limit file can not be updated: " + str(e))
+        return Acquired
+
+    # Log the scheduler statistics using the log function, i.e. Domoticz.Debug
+    def LogSchedulerStatistics(self, log):
+        log("Queue depth: " + str(len(self.RequestQueue)) + " (max " + str(self.QueueDepthMax) + "), In flight: " + str(len(self.RequestsInFlight)) + ", Polls dropped: " + str(self.PollsDropped))
+        log("Wait time commands: " + self.CommandWaitTime.ToString() + "; polls: " + self.PollWaitTime.ToString() + "; Command latency: " + self.CommandLatency.ToString())
+        return
+
+    # Get the senddata parameters (JSON) for the request
+    def GetSendData(self, request):
+        if self.Transport == TRANSPORTJSONRPC:
+            body = self.GetJSONRPCBody(request)
+            Domoticz.Debug(body)
+            return { 'Verb' : 'POST',
+                     'URL'  : JSONRPCURL,
+                     'Headers' : { 'Content-Type': 'application/json', \
+                                   'Connection': 'keep-alive', \
+                                   'Host': Parameters["Address"], \
+                                   'User-Agent':'Domoticz/1.0' },
+                     'Data' : body
+                   }
+        url = self.GetURL(request.Task, request.Thermostat, request.Value)
+        Domoticz.Debug(url)
+        return { 'Verb' : 'GET',
+                 'URL'  : url,
+                 'Headers' : { 'Content-Type': 'text/xml; charset=utf-8', \
+                               'Connection': 'keep-alive', \
+                               'Accept': 'Content-Type: text/html; charset=UTF-8', \
+                               'Host': Parameters["Address"], \
+                               'User-Agent':'Domoticz/1.0' }
+               }
+
+    # Get the JSON-RPC request body for the task
+    def GetJSONRPCBody(self, request):
+        # Login with the CCU WebUI user - the value logout closes the session
+        if request.Task == TASKLOGIN:
+            if request.Value == "logout":
+                Method, Params = "Session.logout", {"_session_id_": self.SessionID}
+            else:
+                Method, Params = "Session.login", {"username": Parameters["Username"], "password": Parameters["Password"]}
+        # Get the device with the address and the interface, i.e. {"address": "000A18A9A64DAC", "interface": "HmIP-RF", ...}
+        if request.Task == TASKGETDEVICE:
+            Method, Params = "Device.get", {"_session_id_": self.SessionID, "id": request.Thermostat.DeviceID}
+        # Get the values of a channel, i.e. {"ACTUAL_TEMPERATURE": "21.100000", "LEVEL": "0.000000", ...}
+        if request.Task == TASKGETDATAPOINTS:
+            Interface, Address = request.Value.split('.', 1)
+            Method, Params = "Interface.getParamset", {"_session_id_": self.SessionID, "interface": Interface, "address": Address, "paramsetKey": "VALUES"}
+        # Set the value of a datapoint - the value is the dict with one change name:(thermostat, new value)
+        if request.Task == TASKSTATECHANGE:
+            DatapointName, Change = list(request.Value.items())[0]
+            Interface, Name = DatapointName.split('.', 1)
+            Address, ValueKey = Name.rsplit('.', 1)
+            ValueType = Change[0].Dispatch[DatapointName]["ValueType"]
+            Method, Params = "Interface.setValue", {"_session_id_": self.SessionID, "interface": Interface, "address": Address, "valueKey": ValueKey,
+                                                    "type": ValueType, "value": Change[1] == "true" if ValueType == "bool" else Change[1]}
+        return json.dumps({"version": "1.1", "method": Method, "params": Params})
+
+    # Get the url parameter (GET request) for the task
+    # If task = getdatapoints then to obtain device state information in xml format
+    # If task = statechange then set the datapoints to the new values, i.e. setpoint and profile
+    def GetURL(self, Task, thermostat, Value):
+        # request all datapoints for all device ids to get the actual data for the defined datapoints
+        if Task == TASKGETDATAPOINTS:
+            ## url example = 'http://192.168.1.225/addons/xmlapi/state.cgi?device_id=' .. ID_DEVICE;
+            ## multiple devices = 'http://192.168.1.225/addons/xmlapi/state.cgi?device_id=1541,1602'
+            url = '/addons/xmlapi/state.cgi?device_id=' + ','.join([t.DeviceID for t in self.Thermostats])
+            
+        # set the new setpoint, profile and/or boost mode - the value is the dict of changes ise_id:(thermostat, new value)
+        if Task == TASKSTATECHANGE:
+            ## url example = 'http://192.168.1.225/addons/xmlapi/statechange.cgi?ise_id=1584&new_value=20
+            ## multiple datapoints = 'http://192.168.1.225/addons/xmlapi/statechange.cgi?ise_id=1584,1566&new_value=20,2
+            url = '/addons/xmlapi/statechange.cgi?ise_id=' + ','.join(Value.keys()) + '&new_value=' + ','.join([str(change[1]) for change in Value.values()])
+        return url
+
+    # The connection is used for all requests and is kept open
+    # The queued requests are send after connecting. The http responses are parsed in onMessage()
     def onConnect(self, Connection, Status, Description):
         Domoticz.Debug("onConnect called")
+        # Push events: the connection to register the callback server or a connection from the CCU to the callback server
+        if Connection.Name != self.httpConn.Name:
+            if self.rpcConn is not None and Connection.Name == self.rpcConn.Name:
+                if (Status == 0) and self.rpcRequest is not None:
+                    self.SendRPCRequestData()
+                elif (Status != 0):
+                    Domoticz.Error("[ERROR] Failed to connect ("+str(Status)+") to the CCU RPC interface: "+Parameters["Address"]+":"+str(CCURPCPORT)+" with error: "+Description)
+            return
         if (Status == 0):
             Domoticz.Debug("CCU connected successfully.")
             self.httpConnected = 1
-
-            # request all datapoints for the device id to get the actual data for the defined datapoints
-            if self.Task == TASKGETDATAPOINTS:
-                ## url example = 'http://192.168.1.225/addons/xmlapi/state.cgi?device_id=' .. ID_DEVICE;
-                url = '/addons/xmlapi/state.cgi?device_id=' + Parameters["Mode1"]
-                
-            # set the new setpoint
-            if self.Task == TASKSETPOINTTEMPERATURE:
-                ## url example = 'http://192.168.1.225/addons/xmlapi/statechange.cgi?ise_id=1584&new_value=
-                url = '/addons/xmlapi/statechange.cgi?ise_id=' + self.DatapointsList[DATAPOINTINDEXSETPOINTTEMPERATURE] + '&new_value=' + str(self.SetPoint)
-
-            # set the new profile
-            if self.Task == TASKSETACTIVEPROFILE:
-                ## url example = 'http://192.168.1.225/addons/xmlapi/statechange.cgi?ise_id=1566&new_value=
-                url = '/addons/xmlapi/statechange.cgi?ise_id=' + self.DatapointsList[DATAPOINTINDEXACTIVEPROFILE] + '&new_value=' + str(self.Profile)
-
-            Domoticz.Debug(url)
-            # define the senddata parameters (JSON)
-            sendData = { 'Verb' : 'GET',
-                         'URL'  : url,
-                         'Headers' : { 'Content-Type': 'text/xml; charset=utf-8', \
-                                       'Connection': 'keep-alive', \
-                                       'Accept': 'Content-Type: text/html; charset=UTF-8', \
-                                       'Host': Parameters["Address"], \
-                                       'User-Agent':'Domoticz/1.0' }
-                       }
-            
-            # Send the data and disconnect
-            self.httpConn.Send(sendData)
-            self.httpConn.Disconnect
+            self.ConnectTime.Add((time.time() - self.ConnectStartTime) * 1000)
+            self.SendQueuedRequests()
             return
         else:
             self.httpConnected = 0
+            # The queued requests are held and send with the next connection - the datapoints request is repeated by the next heartbeat
+            self.AddError("connect")
             Domoticz.Error("[ERROR] Failed to connect ("+str(Status)+") to: "+Parameters["Address"]+":"+Parameters["Port"]+" with error: "+Description)
+            self.BreakerFailure()
             return
 
     def onMessage(self, Connection, Data):
         Domoticz.Debug("onMessage called")
+        self.ProcessWorkerResults()
+
+        # Push events: the response of the CCU to register the callback server or a request (events) from the CCU
+        if Connection.Name != self.httpConn.Name:
+            if self.rpcConn is not None and Connection.Name == self.rpcConn.Name:
+                Domoticz.Debug("RPC response: " + str(Data.get("Status")))
+                self.rpcConn.Disconnect()
+            else:
+                self.HandleRPCRequest(Connection, Data)
+            return
 
         # If not conected, then leave
         if self.httpConnected == 0:
             return
 
+        # Get the task of the request this response belongs to - the responses are received in the order the requests are send
+        if not self.RequestsInFlight:
+            Domoticz.Debug("Response without request ignored.")
+            return
+        request = self.RequestsInFlight.pop(0)
+        self.ReleaseRequests(1)
+        Task = request.Task
+        thermostat = request.Thermostat
+        if request.Priority == PRIORITYCOMMAND:
+            self.CommandLatency.Add(time.time() - request.QueuedTime)
+        ## Domoticz passes the complete response - the response time is measured from sending the request to receiving the response
+        self.ResponseTime.Add((time.time() - request.SentTime) * 1000)
+
         # Parse the JSON Data Object with keys Status (Number) and Data (ByteArray)
         ## 200 is OK
         responseStatus = int(Data["Status"])
         Domoticz.Debug("STATUS=responseStatus:" + str(responseStatus) + " ;Data[Status]="+Data["Status"])
 
-        ## decode the data using the encoding as given in the xml response string
-        responseData = Data["Data"].decode('ISO-8859-1')
-        ## Domoticz.Debug("DATA=" + responseData)
+        ## the data is not decoded - the xml parser reads the raw bytes using the encoding as given in the xml response string (ISO-8859-1)
+        ## a memoryview is used to feed the data in chunks to the parser without copying the response
+        responseData = memoryview(Data.get("Data", b""))
+        self.ResponseSize.Add(len(responseData))
+        ## Domoticz.Debug("DATA=" + bytes(responseData).decode('ISO-8859-1'))
 
         if (responseStatus != 200):
-            Domoticz.Error("[ERROR] XML-API response: " + str(responseStatus) + ";" + resonseData)
+            self.AddError(responseStatus)
+            Domoticz.Error("[ERROR] XML-API response: " + str(responseStatus) + ";" + bytes(responseData).decode('ISO-8859-1'))
+            self.BreakerFailure()
+            self.SendQueuedRequests()
+            return
+        self.BreakerSuccess()
+
+        # JSON-RPC: handle the response of the task
+        if self.Transport == TRANSPORTJSONRPC:
+            self.HandleJSONRPCResponse(request, responseData)
+            self.SendQueuedRequests()
             return
 
-        # Parse the xml string 
-        # Get the xml tree - requires several conversions
-        tree = etree.fromstring(bytes(responseData, encoding='utf-8'))
-        
         # Handle the respective task to update the domoticz devices
-        if self.Task == TASKGETDATAPOINTS:
+        if Task == TASKGETDATAPOINTS:
             Domoticz.Debug("TASKGETDATAPOINTS")
-            # init helper vars
-            atv = 0.0       #actualtemperaturevalue
-            lbv = ""        #lowbatteryvalue
-            spvrm = 0.0     #setpointvalueraspberrymatic
-            spvdom = 0.0    #setpointvaluedomoticz
-            lvlv = 0        #levelvalue
-            pv = 0          #profilevalue
-                        
-            # Get the value for datapoint actual_temperature & update the device and log
-            ## <datapoint name="HmIP-RF.000A18A9A64DAC:1.ACTUAL_TEMPERATURE" type="ACTUAL_TEMPERATURE" ise_id="1567" value="23.000000" valuetype="4" valueunit="" timestamp="1610965660"/>
-            actualtemperaturevalue = tree.find(".//datapoint[@ise_id='" + self.DatapointsList[DATAPOINTINDEXACTUALTEMPERATURE] + "']").attrib['value']
-            ## convert the raspberrymatic value to float
-            atv = float(actualtemperaturevalue)
-            ## update the device if raspmatic value not equal domoticz value
-            if atv != self.Temperature:
-                Devices[UNITACTUALTEMPERATURE].Update( nValue=0, sValue=str(round(atv,2)) )
-                Domoticz.Debug("T Update=" + Devices[UNITACTUALTEMPERATURE].sValue)
-            self.Temperature = atv
-
-            # Get the value for datapoint low_bat & update the device and log
-            lowbat = tree.find(".//datapoint[@ise_id='" + self.DatapointsList[DATAPOINTINDEXLOWBAT] + "']").attrib['value']
-            ## Battery status: false=green (1), true=red (4); store the lowbat state
-            ## update the device if raspmatic value not equal domoticz value
-            lbv = lowbat
-            if lbv != self.LowBat:
-                if lbv == "false":
-                    Devices[UNITLOWBAT].Update( nValue=1, sValue=LOWBATMSGOK )
-                if lbv == "true":
-                    Devices[UNITLOWBAT].Update( nValue=4, sValue=LOWBATMSGNOK )
-                Domoticz.Debug("B Update=" + Devices[UNITLOWBAT].sValue)
-            self.LowBat = lbv
-
-            # Get the value for datapoint set_point_temperature & update the device and log
-            setpointtemperaturevalue = tree.find(".//datapoint[@ise_id='" + self.DatapointsList[DATAPOINTINDEXSETPOINTTEMPERATURE] + "']").attrib['value']
-            ## setpoint value raspberrymatic
-            spvrm = float(setpointtemperaturevalue)
-            ## setpoint value domoticz
-            spvdomsvalue = Devices[UNITSETPOINTTEMPERATURE].sValue
-            Domoticz.Debug("SP DOMOTICZ sValue=" + spvdomsvalue)
+            # Skip the response if identical to the previous response - not if datapoints are to be discovered
+            DiscoverDeviceIDs = self.GetDiscoverDeviceIDs()
+            Digest = zlib.crc32(responseData)
+            if Digest == self.ResponseDigest and not DiscoverDeviceIDs:
+                self.SkipDatapoints()
+                self.SendQueuedRequests()
+                return
+            # Parse the xml string
+            ParseStartTime = time.time()
             try:
-                ## check if the domoticz setpoint svalue is empty. if the case then set to raspberrymatic setpointvalue
-                if not spvdomsvalue:
-                    spvdomsvalue = setpointtemperaturevalue
-                    Devices[UNITSETPOINTTEMPERATURE].Update( nValue=1, sValue= str(spvrm) )    
-                spvdom = float(spvdomsvalue)
-                ## Devices[UNITSETPOINTTEMPERATURE].Update( nValue=1, sValue= str(setpointtemperaturevalue[0]) )    
-                ## Domoticz.Debug("SP RM=" + str(spvrm) + ", SP DOM=" + str(spvdom))
-                ## Update the setpoint if changed by homematic or manual and not equal domoticz setpoint
-                if spvdom != spvrm:
-                    Devices[UNITSETPOINTTEMPERATURE].Update( nValue=1, sValue= str(spvrm) )    
-                    Domoticz.Debug("SP Update=RM=" + str(spvrm) + ", DOM=" + str(spvdom))
+                Datapoints = ParseDatapoints(responseData, self.DatapointIDs, DiscoverDeviceIDs, self.DatapointTypes)
+                self.ResponseDigest = Digest
+            except etree.ParseError as e:
+                self.AddError("parse")
+                Domoticz.Error("[ERROR] XML-API response can not be parsed: " + str(e))
+                self.SendQueuedRequests()
+                return
+            self.ParseTime.Add((time.time() - ParseStartTime) * 1000)
+            self.ApplyDatapoints(*Datapoints)
+
+        if Task == TASKSTATECHANGE:
+            self.HandleStateChange(request)
+
+        # Send the next queued request
+        self.SendQueuedRequests()
+        return
+
+    # The CCU confirmed the setpoint and/or profile change - update the thermostats and confirm the new state with fast datapoints requests
+    def HandleStateChange(self, request):
+        Domoticz.Debug("TASKSTATECHANGE")
+        # The next datapoints response contains the changed datapoints
+        self.ResponseDigest = None
+        # Confirm the new state with fast datapoints requests
+        self.ConfirmPolls = CONFIRMPOLLS
+        self.PollInterval = int(Parameters["Mode5"])
+        self.NextPollTime = min(self.NextPollTime, time.time() + CONFIRMPOLLINTERVAL)
+        self.UpdateHeartbeat()
+        # Update the devices of the changed datapoints, i.e. the setpoint and the profile selector switch
+        for DatapointID, (thermostat, Value) in request.Value.items():
+            Mapping = thermostat.Dispatch.get(DatapointID)
+            if Mapping is not None:
+                self.UpdateValue(thermostat, Mapping, str(Value))
+        return
+
+    # JSON-RPC: handle the response, i.e. {"version": "1.1", "result": ..., "error": null}
+    def HandleJSONRPCResponse(self, request, responseData):
+        ParseStartTime = time.time()
+        try:
+            response = json.loads(bytes(responseData))
+        except ValueError as e:
+            self.AddError("parse")
+            Domoticz.Error("[ERROR] JSON-RPC response can not be parsed: " + str(e))
+            return
+        self.ParseTime.Add((time.time() - ParseStartTime) * 1000)
+        if response.get("error"):
+            Domoticz.Error("[ERROR] JSON-RPC response: " + str(response["error"]))
+            self.AddError("jsonrpc")
+            # If the login failed, login again with the next request
+            if request.Task == TASKLOGIN:
+                self.SessionID = ""
+                return
+            # Login again if the session has expired and send the failed request again after the login - other errors drop the request
+            Message = str(response["error"].get("message", "") if isinstance(response["error"], dict) else response["error"]).lower()
+            if any(SessionError in Message for SessionError in JSONRPCSESSIONERRORS):
+                self.SessionID = ""
+                self.QueueLogin()
+                if request.Retries < JSONRPCRETRIES:
+                    request.Retries += 1
+                    self.QueueRequest(request)
+                else:
+                    Domoticz.Error("[ERROR] JSON-RPC request dropped after " + str(request.Retries) + " retries.")
+            return
+        result = response.get("result")
+        ## Device.get and Interface.getParamset must return an object - i.e. null for an unknown address
+        if request.Task in (TASKGETDEVICE, TASKGETDATAPOINTS) and (not isinstance(result, dict) or request.Task == TASKGETDEVICE and "address" not in result):
+            self.AddError("jsonrpc")
+            Domoticz.Error("[ERROR] JSON-RPC response without result for device " + request.Thermostat.DeviceID + ": " + str(result))
+            return
+        if request.Task == TASKLOGIN:
+            self.SessionID = result if isinstance(result, str) else ""
+            Domoticz.Debug("JSON-RPC session: " + self.SessionID)
+            if not self.SessionID:
+                Domoticz.Error("[ERROR] JSON-RPC login failed. Check the username and password.")
+        if request.Task == TASKGETDEVICE:
+            # Set the datapoint names from the device address - the names are used as datapoint ids
+            ## The optional datapoints are empty until found in the values of the channel (see ResolveOptionalDatapoints)
+            thermostat = request.Thermostat
+            thermostat.DatapointsList = [result.get("interface", "HmIP-RF") + "." + result["address"] + ":" + str(DATAPOINTMAP[DatapointType]["Channel"]) + "." + DatapointType if Index < DATAPOINTS else ""
+                                         for Index, DatapointType in enumerate(self.DatapointTypes)]
+            for DatapointName in thermostat.DatapointsList[:DATAPOINTS]:
+                self.DatapointNames[DatapointName] = DatapointName
+            self.UpdateDatapointIDs()
+            Domoticz.Log("Datapoints resolved for device " + thermostat.DeviceID + ": " + ','.join(thermostat.DatapointsList))
+            self.QueueParamsetRequests(thermostat)
+        if request.Task == TASKGETDATAPOINTS:
+            self.ResolveOptionalDatapoints(request.Thermostat, request.Value, result)
+            # Get the values of the datapoints of the channel, i.e. HmIP-RF.000A18A9A64DAC:1 + ACTUAL_TEMPERATURE
+            values = {}
+            for ValueKey, Value in result.items():
+                DatapointName = request.Value + "." + ValueKey
+                if DatapointName in self.DatapointIDs:
+                    ## Convert the value to the XML-API value format, i.e. true/false
+                    if isinstance(Value, bool):
+                        Value = "true" if Value else "false"
+                    values[DatapointName] = str(Value)
+            try:
+                if self.UpdateThermostat(values, request.Thermostat):
+                    self.PollChanged = True
             except:
-                Domoticz.Error("[ERROR] Setpoint Update. Can not convert Domoticz sValue to float:" + str(spvdomsvalue))
-                
-            # Get the value for datapoint level & update the device and log
-            levelvalue = tree.find(".//datapoint[@ise_id='" + self.DatapointsList[DATAPOINTINDEXLEVEL] + "']").attrib['value']
-            ## convert the raspberrymatic value to an int times 100 to get the value between 0 - 100%
-            lvlv = float(levelvalue) * 100
-            ## update the device if raspmatic value not equal domoticz value
-            if lvlv != self.Level:
-                Devices[UNITLEVEL].Update( nValue=0, sValue=str(round(lvlv,0)) )
-                Domoticz.Debug("L Update=" + Devices[UNITLEVEL].sValue)
-            self.Level = lvlv
-
-            # Get the value for datapoint active_profile & update the device and log
-            profile = tree.find(".//datapoint[@ise_id='" + self.DatapointsList[DATAPOINTINDEXACTIVEPROFILE] + "']").attrib['value']
-            ## Active profile: 1-3; store the active profile
-            ## update the device if raspmatic value not equal domoticz value
-            ## the nvalue must be 2 to ensure the selector is on
-            ## the svalue is the level between 10 - 30, means the profile 1 - 3 needs to be converted to 10 -30
-            pv = int(profile)
-            if pv != self.Profile:
-                Devices[UNITACTIVEPROFILE].Update( nValue=2, sValue=str(pv * 10) )
-                Domoticz.Debug("P Update=" + Devices[UNITACTIVEPROFILE].sValue)
-            self.Profile = pv
-            # Domoticz.Debug("TASKGETDATAPOINTS:" + Parameters["Key"] + ":T=" + str(atv) + ", SP=" + str(spvrm) + ", B=" + lbv + ", L=" + str(lvlv) + ", P=" + str(pv) )
-            # Domoticz.Log("TASKGETDATAPOINTS:" + Parameters["Key"] + ":T=" + str(atv) + ", SP=" + str(spvrm) + ", B=" + lbv + ", L=" + str(lvlv) + ", P=" + str(pv) )
-            
-        if self.Task == TASKSETPOINTTEMPERATURE:
-            Domoticz.Debug("TASKSETPOINTTEMPERATURE")
-            # Update the thermostat
-            Devices[UNITSETPOINTTEMPERATURE].Update( nValue=1, sValue= str(self.SetPoint) )    
-            # NOT REQUIRED = Devices[UNITSETPOINTTEMPERATURE].Refresh()    
+                Domoticz.Error("[ERROR] Datapoint values can not be converted for device " + request.Thermostat.DeviceID + ".")
+            # All channels received - adapt the check interval
+            if not any(pending.Task in (TASKGETDATAPOINTS, TASKGETDEVICE) for pending in self.RequestQueue + self.RequestsInFlight):
+                self.AdaptPollInterval(self.PollChanged)
+                self.AddHistorySamples()
+                self.PollChanged = False
+                self.LogFirstState(True)
+        if request.Task == TASKSTATECHANGE:
+            self.HandleStateChange(request)
+        return
+
+    # JSON-RPC: set the names of the optional datapoints found in the values of the channel and create their devices
+    ## Channel: i.e. HmIP-RF.000A18A9A64DAC:1, Values: the result of Interface.getParamset, i.e. {"BOOST_MODE": false, ...}
+    def ResolveOptionalDatapoints(self, thermostat, Channel, Values):
+        Resolved = False
+        for Index in range(DATAPOINTS, len(self.DatapointTypes)):
+            DatapointType = self.DatapointTypes[Index]
+            if thermostat.DatapointsList[Index] or DatapointType not in Values or not Channel.endswith(":" + str(DATAPOINTMAP[DatapointType]["Channel"])):
+                continue
+            thermostat.DatapointsList[Index] = Channel + "." + DatapointType
+            self.DatapointNames[thermostat.DatapointsList[Index]] = thermostat.DatapointsList[Index]
+            Resolved = True
+        if Resolved:
+            self.UpdateDatapointIDs()
+            self.CreateDevices(thermostat)
+        return
 
-        if self.Task == TASKSETACTIVEPROFILE:
-            Domoticz.Debug("TASKSETACTIVEPROFILE")
-            # Update the profile selector switch
-            Devices[UNITACTIVEPROFILE].Update( nValue=2, sValue= str(self.Profile * 10) )    
-            # NOT REQUIRED = Devices[UNITACTIVEPROFILE].Refresh()    
+    # Log the time and number of requests to the first valid state of all thermostats
+    def LogFirstState(self, Valid):
+        if not self.FirstStateLogged and Valid and all(thermostat.DatapointsList for thermostat in self.Thermostats):
+            self.FirstStateLogged = True
+            Domoticz.Log("First valid state after " + str(round(time.time() - self.StartTime, 3)) + " s, CCU requests: " + str(self.RequestsSent) + ", Device updates: " + str(self.DeviceUpdates))
         return
 
-    # Handle oncomand for:
-    # Set the setpoint - Create http connection, the setpoint is set in onConnect
+    # The response was identical to the previous response - nothing changed
+    def SkipDatapoints(self):
+        self.ResponsesSkipped += 1
+        Domoticz.Debug("Response unchanged (Skipped: " + str(self.ResponsesSkipped) + ")")
+        self.AdaptPollInterval(False)
+        self.AddHistorySamples()
+        ## The unchanged response confirms the values restored from the snapshot
+        self.LogFirstState(True)
+        return
+
+    # Apply the parsed datapoints of the XML-API state response (see ParseDatapoints) to the thermostats
+    def ApplyDatapoints(self, discovered, values, timestamps, names):
+        if discovered is not None:
+            self.DiscoverDatapoints(discovered)
+        self.DatapointNames.update(names)
+        # Only apply the datapoints with a changed timestamp
+        changedvalues = {}
+        for DatapointID, Value in values.items():
+            if timestamps[DatapointID] != self.DatapointTimestamps.get(DatapointID):
+                changedvalues[DatapointID] = Value
+        self.DatapointsSkipped += len(values) - len(changedvalues)
+        # The response contains the state of all devices - update the devices of each thermostat
+        Changed = False
+        for thermostat in self.Thermostats:
+            if not thermostat.DatapointsList:
+                continue
+            ## Only the required datapoints are checked - optional datapoints may be missing
+            if any(DatapointID not in values for DatapointID in thermostat.DatapointsList[:DATAPOINTS]):
+                if thermostat.DatapointsConfigured:
+                    Domoticz.Error("[ERROR] Datapoints not found in XML-API response for device " + thermostat.DeviceID + ". Check the datapoint IDs.")
+                else:
+                    self.InvalidateDatapoints(thermostat)
+                    continue
+            try:
+                if self.UpdateThermostat(changedvalues, thermostat):
+                    Changed = True
+            except:
+                Domoticz.Error("[ERROR] Datapoint values can not be converted for device " + thermostat.DeviceID + ".")
+                continue
+            ## The timestamps are stored after the update - the values of a failed update are applied again with the next response
+            self.DatapointTimestamps.update({DatapointID: timestamps[DatapointID] for DatapointID in thermostat.Dispatch if DatapointID in timestamps})
+        self.AdaptPollInterval(Changed)
+        self.AddHistorySamples()
+        self.LogFirstState(len(values) > 0)
+        return
+
+    # Update the devices of a thermostat from the datapoint values (dict ise_id:value) of the XML-API state response or the CCU events
+    # Only the datapoints contained in the values are updated - one pass over the dispatch of the thermostat (see UpdateDatapointIDs)
+    # Returns True if the actual temperature, setpoint or valve level changed
+    def UpdateThermostat(self, values, thermostat):
+        Changed = False
+        for DatapointID, Mapping in thermostat.Dispatch.items():
+            if DatapointID in values:
+                if self.UpdateValue(thermostat, Mapping, values[DatapointID]) and Mapping["Changed"]:
+                    Changed = True
+        return Changed
+
+    # Convert the datapoint value and update the device if the value is not equal the last value applied (the device sValue is not read)
+    # Returns True if the value changed
+    ## <datapoint name="HmIP-RF.000A18A9A64DAC:1.ACTUAL_TEMPERATURE" type="ACTUAL_TEMPERATURE" ise_id="1567" value="23.000000" valuetype="4" valueunit="" timestamp="1610965660"/>
+    def UpdateValue(self, thermostat, Mapping, Value):
+        Value = Mapping["Convert"](Value)
+        LastValue = getattr(thermostat, Mapping["Attribute"])
+        if Value == LastValue:
+            return False
+        setattr(thermostat, Mapping["Attribute"], Value)
+        Domoticz.Debug(Mapping["Attribute"] + " Update=" + str(Value) + ", last=" + str(LastValue))
+        Device = Mapping["Device"](Value)
+        if Device is not None:
+            self.UpdateDevice(thermostat.Unit(Mapping["Unit"]), Device[0], Device[1])
+        return True
+
+    # Handle oncomand for the writeable datapoints (see DATAPOINTMAP):
+    # Set the setpoint - The change is send after the debounce window via the persistent http connection
     # Set the active profile
+    # Set the boost mode
     def onCommand(self, Unit, Command, Level, Hue):
+        self.ProcessWorkerResults()
         # onCommand called. Example:
         # Unit 1 - UNITSETPOINTTEMPERATURE: Parameter: 'Set Level', Level: 18.5
         # Unit 5 - UNITACTIVEPROFILE: Parameter: 'Set Level', Level: 20
+        # Unit 21 - UNITACTIVEPROFILE of the 2nd thermostat: Parameter: 'Set Level', Level: 20
+        # Unit 6 - UNITBOOSTMODE: Parameter: 'On', Level: 0
         Domoticz.Log("onCommand called for Unit " + str(Unit) + ": Parameter '" + str(Command) + "', Level: " + str(Level))
 
-        if (Unit == UNITSETPOINTTEMPERATURE):
-            ## Set the new setpoint temperature
-            self.SetPoint = Level
-            Domoticz.Debug("T Setpoint=" + str(self.SetPoint))
-            # Create IP connection and connect - see further onConnect where the parameters are send
-            self.httpConn = Domoticz.Connection(Name="CCU-"+Parameters["Address"], Transport="TCP/IP", Protocol="HTTP", Address=Parameters["Address"], Port="80")
-            self.httpConn.Connect()
-            self.httpConnected = 0
-            self.Task = TASKSETPOINTTEMPERATURE
+        # Get the thermostat the unit belongs to
+        thermostat = self.GetThermostat(Unit)
+        if thermostat is None:
+            Domoticz.Error("[ERROR] No thermostat found for unit " + str(Unit) + ".")
+            return
+        if not thermostat.DatapointsList:
+            Domoticz.Error("[ERROR] Datapoints not discovered yet for device " + thermostat.DeviceID + ".")
+            return
+
+        ## Set the new value, i.e. the profile level 10 - 30 is converted to the profile 1 - 3
+        ## The thermostat value is set if the CCU confirmed the change
+        for DatapointID, Mapping in thermostat.Dispatch.items():
+            if Unit == thermostat.Unit(Mapping["Unit"]) and "Write" in Mapping:
+                Value = Mapping["Write"](Command, Level)
+                Domoticz.Debug(Mapping["Attribute"] + " Write=" + str(Value))
+                if Value is not None:
+                    self.AddWrite(DatapointID, thermostat, Value)
+        return
 
-        if (Unit == UNITACTIVEPROFILE):
-            ## Set the new profile - the level is between 10 - 30, which must be converted to profile 1 - 3 (int therefor round)
-            if (Level > 0):
-                self.Profile = round(Level / 10)
-                Domoticz.Debug("P Profile=" + str(self.Profile))
-                # Create IP connection and connect - see further onConnect where the parameters are send
-                self.httpConn = Domoticz.Connection(Name="CCU-"+Parameters["Address"], Transport="TCP/IP", Protocol="HTTP", Address=Parameters["Address"], Port="80")
-                self.httpConn.Connect()
-                self.httpConnected = 0
-                self.Task = TASKSETACTIVEPROFILE
+    # Add a datapoint change. A change of the same datapoint within the debounce window replaces the previous change.
+    # The first change starts the debounce window and sets the heartbeat to 1 second to send the changes when the window has passed.
+    def AddWrite(self, DatapointID, thermostat, Value):
+        if DatapointID in self.PendingWrites:
+            self.WritesSuppressed += 1
+        self.PendingWrites[DatapointID] = (thermostat, Value)
+        if WRITEDEBOUNCE <= 0:
+            self.SendWrites()
+            return
+        if len(self.PendingWrites) == 1:
+            self.WriteDueTime = time.time() + WRITEDEBOUNCE
+            self.UpdateHeartbeat()
+        return
+
+    # Send the pending changes with one statechange request and restore the heartbeat
+    def SendWrites(self):
+        Domoticz.Debug("Writes: " + str(len(self.PendingWrites)))
+        self.WritesSent += len(self.PendingWrites)
+        self.SendRequest(TASKSTATECHANGE, None, self.PendingWrites)
+        self.PendingWrites = {}
+        self.UpdateHeartbeat()
+        return
+
+    # Check if the time (time.time()) is reached - the heartbeat may be called slightly before the time it was set for
+    def IsDue(self, Time):
+        return time.time() >= Time - SCHEDULETOLERANCE
+
+    # Set the Domoticz heartbeat depending the pending changes (1 second) and confirmation requests (CONFIRMPOLLINTERVAL)
+    # Until the first heartbeat, the heartbeat is max the phase offset
+    def UpdateHeartbeat(self):
+        if self.PendingWrites or self.WorkerPending or self.RateLimited:
+            Heartbeat = 1
+        elif self.ConfirmPolls > 0:
+            Heartbeat = min(CONFIRMPOLLINTERVAL, self.HeartbeatInterval)
+        else:
+            Heartbeat = self.HeartbeatInterval
+        if self.HeartbeatCounter == 0 and self.PhaseOffset > 0:
+            Heartbeat = min(Heartbeat, self.PhaseOffset)
+        self.SetHeartbeat(Heartbeat)
+        return
 
+    # Set the Domoticz heartbeat (seconds) if changed
+    def SetHeartbeat(self, Heartbeat):
+        if Heartbeat != self.Heartbeat:
+            self.Heartbeat = Heartbeat
+            Domoticz.Heartbeat(Heartbeat)
         return
 
     def onNotification(self, Name, Subject, Text, Status, Priority, Sound, ImageFile):
         Domoticz.Debug("Notification: " + Name + "," + Subject + "," + Text + "," + Status + "," + str(Priority) + "," + Sound + "," + ImageFile)
 
+    # The CCU closed the connection (i.e. keep-alive timeout) - reconnect with the next request
+    # Requests without response are send again after reconnecting
     def onDisconnect(self, Connection):
         Domoticz.Debug("onDisconnect called")
+        if Connection.Name != self.httpConn.Name:
+            return
+        self.httpConnected = 0
+        if self.RequestsInFlight:
+            Domoticz.Debug("Requests without response: " + str(len(self.RequestsInFlight)) + ". Reconnecting.")
+            self.RequeueRequestsInFlight()
+            if self.Breaker.State != BREAKEROPEN:
+                self.Connect()
 
     def onHeartbeat(self):
+        # count the heartbeat before processing the worker results - these restore the heartbeat after the phase offset (UpdateHeartbeat)
         self.HeartbeatCounter = self.HeartbeatCounter + 1
-        Domoticz.Debug("onHeartbeat called. Counter=" + str(self.HeartbeatCounter * self.HeartbeatInterval) + " (Heartbeat=" + Parameters["Mode5"] + ")")
-        # check the heartbeatcounter against the heartbeatinterval
-        if (self.HeartbeatCounter * self.HeartbeatInterval) % int(Parameters["Mode5"]) == 0:
+        self.ProcessWorkerResults()
+        self.CheckRequestTimeout()
+        # connect again if requests are queued, i.e. after a failed connect or a timeout (the breaker is not yet open)
+        if self.RequestQueue and self.Breaker.State == BREAKERCLOSED and not self.httpConn.Connected() and not self.httpConn.Connecting():
+            self.Connect()
+        # send the requests delayed by the rate limit and restore the heartbeat (i.e. after the phase offset)
+        if self.RateLimited:
+            self.RateLimited = False
+            if self.httpConn.Connected():
+                self.SendQueuedRequests()
+        self.UpdateHeartbeat()
+        Domoticz.Debug("onHeartbeat called. Counter=" + str(self.HeartbeatCounter) + " (Heartbeat=" + Parameters["Mode5"] + ", next request in " + str(round(self.NextPollTime - time.time())) + " s)")
+        # send the pending setpoint and profile changes if the debounce window has passed
+        if self.PendingWrites and time.time() >= self.WriteDueTime:
+            self.SendWrites()
+        # write the telemetry file and update the telemetry devices
+        if self.IsDue(self.NextTelemetryTime):
+            self.NextTelemetryTime = time.time() + TELEMETRYINTERVAL
+            self.PublishTelemetry()
+        # save the snapshot of the last applied values
+        if self.IsDue(self.NextSnapshotTime):
+            self.NextSnapshotTime = time.time() + SNAPSHOTINTERVAL
+            self.SaveSnapshot()
+        # circuit breaker open: send a single probe request (datapoints) if the backoff time has passed
+        if self.Breaker.StartProbe():
+            Domoticz.Log("Sending probe request. " + self.Breaker.ToString())
+            self.Poll()
+        # check the time against the next time to request the datapoints
+        if self.IsDue(self.NextPollTime):
+            # renew the registration of the callback server - the CCU drops the registration if the callback server was not reachable
+            if self.PushEvents:
+                self.SendRPCRequest("init", (self.rpcCallbackURL, self.rpcInterfaceID))
             try:
-                # Create IP connection
-                self.httpConn = Domoticz.Connection(Name="CCU-"+Parameters["Address"], Transport="TCP/IP", Protocol="HTTP", Address=Parameters["Address"], Port="80")
-                self.httpConn.Connect()
-                self.httpConnected = 0
-                self.Task = TASKGETDATAPOINTS
+                # Request the datapoints via the persistent connection
+                self.Poll()
+                Domoticz.Debug("Connections opened: " + str(self.ConnectionsOpened) + ", Requests sent: " + str(self.RequestsSent))
+                self.LogSchedulerStatistics(Domoticz.Debug)
+                Domoticz.Debug(self.Breaker.ToString())
                 return
             except:
                 Domoticz.Error("[ERROR] Check settings, correct and restart Domoticz.")
@@ -454,6 +2104,104 @@ def onHeartbeat():
 ## Generic helper functions
 #
 
+# Get the datapoints of devices from a XML-API state response by datapoint type.
+# Returns a dict with key device ise_id and value a dict with key datapoint type and value the datapoint ise_id (first datapoint of the type).
+## Example: {"1541": {"SET_POINT_TEMPERATURE": "1584", "ACTUAL_TEMPERATURE": "1567", ...}}
+def GetDeviceDatapointsByType(data, deviceIDs, datapointTypes):
+    devices = {}
+    deviceID = None
+    parser = etree.XMLPullParser(events=("start", "end"))
+    for position in range(0, len(data), PARSERCHUNKSIZE):
+        parser.feed(data[position:position + PARSERCHUNKSIZE])
+        for event, element in parser.read_events():
+            if event == "start":
+                if element.tag == "device":
+                    deviceID = element.get("ise_id")
+                continue
+            if element.tag == "datapoint" and deviceID in deviceIDs:
+                datapointType = element.get("type")
+                if datapointType in datapointTypes:
+                    devices.setdefault(deviceID, {}).setdefault(datapointType, element.get("ise_id"))
+            elif element.tag == "device":
+                deviceID = None
+            element.clear()
+    return devices
+
+# Parse the XML-API state response
+# Discover the datapoints of the devices without datapoints (deviceIDs) and get the values, timestamps and names of the datapoints in a single pass.
+# Returns (discovered datapoints or None, values, timestamps, names). Raises etree.ParseError.
+def ParseDatapoints(data, datapointIDs, deviceIDs, datapointTypes):
+    discovered = None
+    if deviceIDs:
+        discovered = GetDeviceDatapointsByType(data, deviceIDs, datapointTypes)
+        datapointIDs = set(datapointIDs)
+        for datapoints in discovered.values():
+            datapointIDs.update(datapoints.values())
+    timestamps = {}
+    names = {}
+    values = GetDatapointValues(data, datapointIDs, names, timestamps)
+    return discovered, values, timestamps, names
+
+# Worker mode: request and parse the datapoints - runs in a worker thread, the result is put to the results queue.
+# No Domoticz functions are called in the worker thread.
+def FetchDatapoints(url, datapointIDs, deviceIDs, datapointTypes, lastDigest, results):
+    result = DatapointsResult()
+    StartTime = time.time()
+    try:
+        with urllib.request.urlopen(url, timeout=WORKERTIMEOUT) as response:
+            result.Status = response.status
+            data = response.read()
+        result.ResponseTime = time.time() - StartTime
+        result.ResponseSize = len(data)
+        result.Digest = zlib.crc32(data)
+        if result.Digest == lastDigest:
+            result.Skipped = True
+        else:
+            StartTime = time.time()
+            result.Datapoints = ParseDatapoints(memoryview(data), datapointIDs, deviceIDs, datapointTypes)
+            result.ParseTime = time.time() - StartTime
+    except urllib.error.HTTPError as e:
+        result.Status = e.code
+        result.ResponseTime = time.time() - StartTime
+    except etree.ParseError as e:
+        result.Error = "parse"
+        result.Message = str(e)
+    except socket.timeout as e:
+        result.Error = "timeout"
+        result.Message = str(e)
+    except Exception as e:
+        result.Error = "connect"
+        result.Message = str(e)
+    results.put(result)
+    return
+
+# Get the values of the datapoints from a XML-API response in a single pass.
+# Returns a dict with key ise_id and the datapoint value attribute.
+# If the dict names is given, the datapoint names are added with the ise_id, i.e. HmIP-RF.000A18A9A64DAC:1.LEVEL:1576.
+# If the dict timestamps is given, the datapoint timestamps are added with the ise_id, i.e. 1576:1610965660.
+# The response (bytes, bytearray or memoryview) is fed in chunks to the parser, which stops as soon as all datapoints are found.
+# The parser detects the encoding from the xml declaration, i.e. <?xml version="1.0" encoding="ISO-8859-1"?>.
+# Elements are cleared after handling to keep the memory used low.
+## <datapoint name="HmIP-RF.000A18A9A64DAC:1.ACTUAL_TEMPERATURE" type="ACTUAL_TEMPERATURE" ise_id="1567" value="23.000000" valuetype="4" valueunit="" timestamp="1610965660"/>
+def GetDatapointValues(data, datapointIDs, names=None, timestamps=None):
+    values = {}
+    parser = etree.XMLPullParser(events=("end",))
+    for position in range(0, len(data), PARSERCHUNKSIZE):
+        parser.feed(data[position:position + PARSERCHUNKSIZE])
+        for event, element in parser.read_events():
+            if element.tag == "datapoint":
+                ise_id = element.get("ise_id")
+                if ise_id in datapointIDs:
+                    values[ise_id] = element.get("value")
+                    if names is not None:
+                        names[element.get("name")] = ise_id
+                    if timestamps is not None:
+                        timestamps[ise_id] = element.get("timestamp")
+            element.clear()
+        if len(values) == len(datapointIDs):
+            break
+    return values
+
 def DumpConfigToLog():
     for x in Parameters:
         if Parameters[x] != "":
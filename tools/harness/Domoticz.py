@@ -0,0 +1,92 @@
+# Offline harness - stand-in for the Domoticz Python plugin module
+# The plugin imports this module as Domoticz when run by the harness driver (see driver.py).
+# All calls are routed to the runtime of the plugin instance which is currently called back (see driver.Instance).
+# Only the part of the Domoticz API used by plugin.py is provided.
+
+## The runtime of the plugin instance currently called back - set by the driver
+Runtime = None
+
+def Debug(Message):
+    Runtime.AddLog("Debug", Message)
+
+def Log(Message):
+    Runtime.AddLog("Log", Message)
+
+def Status(Message):
+    Runtime.AddLog("Status", Message)
+
+def Error(Message):
+    Runtime.AddLog("Error", Message)
+
+def Debugging(Mask):
+    return
+
+# Set the heartbeat interval (seconds) of the plugin instance
+def Heartbeat(Interval):
+    Runtime.SetHeartbeat(Interval)
+
+# Connection - the connect, the requests and the responses are simulated by the driver using the stub CCU (see ccu.py)
+class Connection:
+
+    def __init__(self, Name="", Transport="TCP/IP", Protocol="HTTP", Address="", Port=""):
+        self.Name = Name
+        self.Transport = Transport
+        self.Protocol = Protocol
+        self.Address = Address
+        self.Port = Port
+        self.IsConnected = False
+        self.IsConnecting = False
+        self.Listening = False
+        self.Runtime = Runtime
+        return
+
+    def Connect(self):
+        self.Runtime.Connect(self)
+
+    def Listen(self):
+        self.Listening = True
+
+    def Send(self, Message, Delay=0):
+        self.Runtime.Send(self, Message)
+
+    def Disconnect(self):
+        self.Runtime.Disconnect(self)
+
+    def Connected(self):
+        return self.IsConnected
+
+    def Connecting(self):
+        return self.IsConnecting
+
+# Device - created devices are added to the Devices dict of the plugin instance
+class Device:
+
+    def __init__(self, Name="", Unit=0, Type=0, Subtype=0, Switchtype=0, Options=None, Used=0, Image=0, TypeName="", DeviceID=""):
+        self.Name = Name
+        self.Unit = Unit
+        self.Type = Type
+        self.SubType = Subtype
+        self.SwitchType = Switchtype
+        self.Options = Options if Options is not None else {}
+        self.Used = Used
+        self.nValue = 0
+        self.sValue = ""
+        self.LastLevel = 0
+        self.ID = Unit
+        self.Updates = 0
+        self.Runtime = Runtime
+        return
+
+    def Create(self):
+        self.Runtime.Devices[self.Unit] = self
+
+    def Update(self, nValue=0, sValue="", **Options):
+        self.nValue = nValue
+        self.sValue = sValue
+        self.Updates += 1
+
+    def Refresh(self):
+        return
+
+    def Delete(self):
+        self.Runtime.Devices.pop(self.Unit, None)
@@ -0,0 +1,51 @@
+# Offline harness - microbenchmark of the XML-API datapoint extraction
+# Compares the v1.3 path (decode/encode copy, full tree, one find() per datapoint) with the single-pass
+# streaming extraction of the plugin (GetDatapointValues) on state.cgi and statelist.cgi payloads of the stub CCU.
+## Usage: python3 tools/harness/bench_parser.py [--repeat 200]
+import argparse
+import timeit
+import importlib.util
+import xml.etree.ElementTree as etree
+
+import driver
+from ccu import StubCCU
+
+# The v1.3 path: decode, encode and parse the full tree, then one find() per datapoint
+def FindDatapointValues(data, datapointIDs):
+    responseData = bytes(data).decode('ISO-8859-1')
+    tree = etree.fromstring(bytes(responseData, encoding='utf-8'))
+    return {ID: tree.find(".//datapoint[@ise_id='" + ID + "']").attrib['value'] for ID in datapointIDs}
+
+def LoadPlugin():
+    Spec = importlib.util.spec_from_file_location("plugin_bench", driver.PLUGINFILE)
+    Module = importlib.util.module_from_spec(Spec)
+    Spec.loader.exec_module(Module)
+    return Module
+
+def main():
+    Parser = argparse.ArgumentParser(description="Datapoint extraction microbenchmark")
+    Parser.add_argument("--repeat", type=int, default=200)
+    Args = Parser.parse_args()
+    plugin = LoadPlugin()
+    # Payloads: (name, data, wanted datapoint ids)
+    Payloads = []
+    for Thermostats in [1, 10]:
+        CCU = StubCCU(Thermostats=Thermostats)
+        IDs = [ID for Device in CCU.Devices for ID in Device.DatapointIDs(driver.DATAPOINTTYPES)]
+        Payloads.append(("state.cgi %d thermostats" % Thermostats, CCU.Handle("GET", "/addons/xmlapi/state.cgi?device_id=" + ",".join([Device.DeviceID for Device in CCU.Devices]))[1], IDs))
+    ## statelist.cgi: all devices of the CCU - the wanted thermostat is the first or the last device
+    CCU = StubCCU(Thermostats=1, OtherDevices=99)
+    Data = CCU.Handle("GET", "/addons/xmlapi/statelist.cgi")[1]
+    Payloads.append(("statelist.cgi 100 devices, first", Data, CCU.Devices[0].DatapointIDs(driver.DATAPOINTTYPES)))
+    Payloads.append(("statelist.cgi 100 devices, last", Data, CCU.OtherDevices[-1].DatapointIDs(driver.DATAPOINTTYPES)))
+    print("%-36s %9s %10s %12s %8s" % ("payload", "bytes", "find() ms", "single ms", "speedup"))
+    for Name, Data, IDs in Payloads:
+        WantedIDs = set(IDs)
+        assert FindDatapointValues(Data, IDs) == plugin.GetDatapointValues(memoryview(Data), WantedIDs)
+        Old = min(timeit.repeat(lambda: FindDatapointValues(Data, IDs), number=Args.repeat, repeat=3)) / Args.repeat * 1000
+        New = min(timeit.repeat(lambda: plugin.GetDatapointValues(memoryview(Data), WantedIDs), number=Args.repeat, repeat=3)) / Args.repeat * 1000
+        print("%-36s %9d %10.3f %12.3f %7.1fx" % (Name, len(Data), Old, New, Old / New))
+    return
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+# Offline harness - stub CCU serving XML-API (state.cgi, statelist.cgi, statechange.cgi) and JSON-RPC (homematic.cgi) responses
+# The responses are modelled on the state.cgi response of a HmIP-eTRV-2 (see the README, Get Device Datapoints).
+# The stub is used in-process by the driver (simulated latency) and can be served via HTTP for the worker mode (see Serve).
+import json
+import threading
+import time
+import urllib.parse
+import http.server
+import xml.sax.saxutils
+
+# Datapoints of a thermostat per channel: (type, valuetype, initial value)
+## The datapoints used by the plugin plus the other datapoints of a HmIP-eTRV-2, so the response size matches a real CCU
+CHANNEL0 = [("CONFIG_PENDING", 2, "false"), ("DUTY_CYCLE", 2, "false"), ("ERROR_CODE", 16, "0"), ("LOW_BAT", 2, "false"),
+            ("OPERATING_VOLTAGE", 4, "2.800000"), ("OPERATING_VOLTAGE_STATUS", 16, "0"), ("RSSI_DEVICE", 8, "-56"),
+            ("RSSI_PEER", 8, "-60"), ("UNREACH", 2, "false"), ("UPDATE_PENDING", 2, "false")]
+CHANNEL1 = [("ACTIVE_PROFILE", 16, "1"), ("ACTUAL_TEMPERATURE", 4, "21.100000"), ("ACTUAL_TEMPERATURE_STATUS", 16, "0"),
+            ("BOOST_MODE", 2, "false"), ("BOOST_TIME", 4, "0.000000"), ("FROST_PROTECTION", 2, "false"), ("LEVEL", 4, "0.150000"),
+            ("LEVEL_STATUS", 16, "0"), ("PARTY_MODE", 2, "false"), ("QUICK_VETO_TIME", 4, "0.000000"), ("SET_POINT_MODE", 16, "0"),
+            ("SET_POINT_TEMPERATURE", 4, "20.000000"), ("SWITCH_POINT_OCCURED", 2, "false"), ("VALVE_ADAPTION", 2, "false"),
+            ("VALVE_STATE", 16, "4"), ("WINDOW_STATE", 16, "0")]
+## Number of ise_ids reserved per device
+IDSPERDEVICE = 100
+
+# A simulated thermostat with the ise_ids of the device, the channels and the datapoints
+class StubDevice:
+
+    def __init__(self, Index):
+        self.DeviceID = str(1000 + Index * IDSPERDEVICE)
+        self.Address = "000A18A9A6%04X" % Index
+        self.Name = "Thermostat " + str(Index + 1)
+        # Datapoints: type:(ise_id, channel, valuetype, value, timestamp)
+        self.Datapoints = {}
+        NextID = int(self.DeviceID) + 1
+        self.ChannelIDs = []
+        for Channel, Datapoints in enumerate([CHANNEL0, CHANNEL1]):
+            self.ChannelIDs.append(str(NextID))
+            NextID += 1
+            for Type, ValueType, Value in Datapoints:
+                self.Datapoints[Type] = [str(NextID), Channel, ValueType, Value, "1576315780"]
+                NextID += 1
+        return
+
+    # Get the ise_ids of the datapoints in the order of the types, i.e. for the parameter Mode2
+    def DatapointIDs(self, Types):
+        return [self.Datapoints[Type][0] for Type in Types]
+
+    def SetValue(self, Type, Value, Timestamp):
+        Datapoint = self.Datapoints[Type]
+        if Datapoint[3] != Value:
+            Datapoint[3] = Value
+            Datapoint[4] = str(int(Timestamp))
+        return
+
+    # XML-API device element
+    def ToXML(self):
+        Lines = ['<device config_pending="false" unreach="false" ise_id="' + self.DeviceID + '" name="' + self.Name + '">']
+        for Channel, ChannelID in enumerate(self.ChannelIDs):
+            Lines.append('<channel ise_id="' + ChannelID + '" name="' + self.Name + ':' + str(Channel) + '">')
+            for Type, (ID, DatapointChannel, ValueType, Value, Timestamp) in self.Datapoints.items():
+                if DatapointChannel == Channel:
+                    Lines.append('<datapoint ise_id="' + ID + '" name="HmIP-RF.' + self.Address + ':' + str(Channel) + '.' + Type +
+                                 '" timestamp="' + Timestamp + '" valueunit="" valuetype="' + str(ValueType) + '" value="' + Value + '" type="' + Type + '"/>')
+            Lines.append('</channel>')
+        Lines.append('</device>')
+        return "\n".join(Lines)
+
+# The stub CCU with the simulated thermostats and other devices (only in statelist.cgi)
+## Configuration (can be changed while running):
+## Latency: seconds from request to response; ConnectLatency: seconds to connect
+## Refuse: connections are refused; Hang: requests get no response
+## FailStatus, FailCount: the next FailCount requests get the HTTP status FailStatus
+## KeepAliveMax: the CCU closes the connection after this number of requests (0 = never)
+## NullResults: JSON-RPC methods answered with a null result without error, i.e. {"Interface.getParamset"}
+class StubCCU:
+
+    def __init__(self, Thermostats=1, OtherDevices=0, Clock=time.time):
+        self.Devices = [StubDevice(Index) for Index in range(Thermostats)]
+        self.OtherDevices = [StubDevice(Thermostats + Index) for Index in range(OtherDevices)]
+        self.DevicesByID = {Device.DeviceID: Device for Device in self.Devices + self.OtherDevices}
+        self.Clock = Clock
+        self.Latency = 0.05
+        self.ConnectLatency = 0.01
+        self.Refuse = False
+        self.Hang = False
+        self.FailStatus = 500
+        self.FailCount = 0
+        self.KeepAliveMax = 0
+        self.NullResults = set()
+        # JSON-RPC sessions
+        self.Sessions = set()
+        self.SessionCounter = 0
+        # Requests received by kind, i.e. state.cgi, statechange.cgi, Interface.getParamset
+        self.Requests = {}
+        self.Lock = threading.Lock()
+        self.Server = None
+        return
+
+    def Count(self, Kind):
+        with self.Lock:
+            self.Requests[Kind] = self.Requests.get(Kind, 0) + 1
+        return
+
+    def TotalRequests(self):
+        return sum(self.Requests.values())
+
+    # Change the actual temperature and valve level of a thermostat (new timestamp)
+    def Drift(self, Index, Temperature, Level):
+        Device = self.Devices[Index]
+        Device.SetValue("ACTUAL_TEMPERATURE", "%.6f" % Temperature, self.Clock())
+        Device.SetValue("LEVEL", "%.6f" % Level, self.Clock())
+        return
+
+    # Expire all JSON-RPC sessions
+    def ExpireSessions(self):
+        self.Sessions = set()
+        return
+
+    def StateXML(self, Devices):
+        return ('<?xml version="1.0" encoding="ISO-8859-1"?>\n<state>\n' + "\n".join([Device.ToXML() for Device in Devices]) + '\n</state>').encode("ISO-8859-1")
+
+    # Handle a request. Returns (status, data) or None if the request gets no response (Hang).
+    def Handle(self, Verb, URL, Body=b""):
+        Path, _, Query = URL.partition("?")
+        Args = urllib.parse.parse_qs(Query)
+        if Path.endswith("/api/homematic.cgi"):
+            Kind = json.loads(Body).get("method", "")
+        else:
+            Kind = Path.rsplit("/", 1)[-1]
+        self.Count(Kind)
+        if self.Hang:
+            return None
+        if self.FailCount > 0:
+            self.FailCount -= 1
+            return (self.FailStatus, b"<html>Error</html>")
+        if Kind == "state.cgi":
+            IDs = Args.get("device_id", [""])[0].split(",")
+            return (200, self.StateXML([self.DevicesByID[ID] for ID in IDs if ID in self.DevicesByID]))
+        if Kind == "statelist.cgi":
+            return (200, self.StateXML(self.Devices + self.OtherDevices))
+        if Kind == "statechange.cgi":
+            return (200, self.StateChange(Args.get("ise_id", [""])[0].split(","), Args.get("new_value", [""])[0].split(",")))
+        if Path == "/":
+            # XML-RPC init (register or unregister the callback server)
+            return (200, b'<?xml version="1.0"?><methodResponse><params><param><value><string></string></value></param></params></methodResponse>')
+        return (200, json.dumps(self.JSONRPC(json.loads(Body))).encode())
+
+    def StateChange(self, IDs, Values):
+        Changed = []
+        for ID, Value in zip(IDs, Values):
+            for Device in self.Devices:
+                for Type, Datapoint in Device.Datapoints.items():
+                    if Datapoint[0] == ID:
+                        Device.SetValue(Type, Value, self.Clock())
+                        Changed.append('<changed id="' + ID + '" new_value="' + xml.sax.saxutils.escape(Value) + '"/>')
+        return ('<?xml version="1.0" encoding="ISO-8859-1"?><result>' + "".join(Changed) + '</result>').encode("ISO-8859-1")
+
+    def JSONRPC(self, Call):
+        Method = Call.get("method")
+        Params = Call.get("params", {})
+        if Method == "Session.login":
+            self.SessionCounter += 1
+            Session = "session" + str(self.SessionCounter)
+            self.Sessions.add(Session)
+            return {"version": "1.1", "result": Session, "error": None}
+        if Method in self.NullResults:
+            return {"version": "1.1", "result": None, "error": None}
+        if Params.get("_session_id_") not in self.Sessions:
+            return {"version": "1.1", "result": None, "error": {"name": "JSONRPCError", "code": 400, "message": "access denied (" + str(Params.get("_session_id_")) + ")"}}
+        if Method == "Session.logout":
+            self.Sessions.discard(Params["_session_id_"])
+            return {"version": "1.1", "result": True, "error": None}
+        if Method == "Device.get":
+            Device = self.DevicesByID.get(Params.get("id"))
+            if Device is None:
+                return {"version": "1.1", "result": None, "error": {"name": "JSONRPCError", "code": 501, "message": "device not found"}}
+            return {"version": "1.1", "result": {"id": Device.DeviceID, "address": Device.Address, "interface": "HmIP-RF", "name": Device.Name}, "error": None}
+        Address, _, Channel = Params.get("address", "").partition(":")
+        Device = next((Device for Device in self.Devices if Device.Address == Address), None)
+        if Device is None:
+            return {"version": "1.1", "result": None, "error": {"name": "JSONRPCError", "code": 501, "message": "unknown address"}}
+        if Method == "Interface.getParamset":
+            return {"version": "1.1", "result": {Type: Datapoint[3] for Type, Datapoint in Device.Datapoints.items() if str(Datapoint[1]) == Channel}, "error": None}
+        if Method == "Interface.setValue":
+            Value = Params.get("value")
+            Value = ("true" if Value else "false") if isinstance(Value, bool) else "%.6f" % Value if isinstance(Value, float) else str(Value)
+            Device.SetValue(Params["valueKey"], Value, self.Clock())
+            return {"version": "1.1", "result": True, "error": None}
+        return {"version": "1.1", "result": None, "error": {"name": "JSONRPCError", "code": 501, "message": "unknown method " + str(Method)}}
+
+    # Serve the stub via HTTP on 127.0.0.1 (i.e. for the worker mode, which requests the datapoints with urllib)
+    ## The latency is applied as real delay. Returns the address:port to use as parameter Address.
+    def Serve(self):
+        CCU = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def Reply(self, Body):
+                Response = CCU.Handle(self.command, self.path, Body)
+                time.sleep(CCU.Latency)
+                if Response is None:
+                    time.sleep(3600)
+                    return
+                self.send_response(Response[0])
+                self.send_header("Content-Length", str(len(Response[1])))
+                self.end_headers()
+                self.wfile.write(Response[1])
+
+            def do_GET(self):
+                self.Reply(b"")
+
+            def do_POST(self):
+                self.Reply(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+
+            def log_message(self, *Args):
+                return
+
+        self.Server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.Server.daemon_threads = True
+        threading.Thread(target=self.Server.serve_forever, daemon=True).start()
+        return "127.0.0.1:" + str(self.Server.server_address[1])
+
+    def Shutdown(self):
+        if self.Server is not None:
+            self.Server.shutdown()
+            self.Server.server_close()
+            self.Server = None
+        return
@@ -0,0 +1,315 @@
+# Offline harness - driver replaying heartbeats, connections and commands through the plugin callbacks
+# Each plugin instance is a separate module object loaded from plugin.py with its own Devices and Parameters.
+# The time is simulated: the clock of the plugin (time.time) is the real time plus an offset, which is advanced to the next event.
+# So the code runs with its real cpu time (i.e. the parse time), while the heartbeats, the connect and the response latency are simulated.
+## Example:
+##   sim = Simulator(StubCCU(Thermostats=2))
+##   instance = sim.AddInstance(HardwareID=7, DeviceIDs=[d.DeviceID for d in sim.CCU.Devices])
+##   sim.Run(600)
+##   instance.Stop()
+import os
+import sys
+import time as _time
+import heapq
+import itertools
+import random
+import tempfile
+import importlib.util
+
+HARNESSFOLDER = os.path.dirname(os.path.abspath(__file__))
+PLUGINFILE = os.path.join(HARNESSFOLDER, "..", "..", "plugin.py")
+
+## The stand-in Domoticz module is imported by plugin.py
+sys.path.insert(0, HARNESSFOLDER)
+import Domoticz
+from ccu import StubCCU
+
+# The datapoint types of the parameter Mode2 in this order (see DATAPOINTTYPES of the plugin)
+DATAPOINTTYPES = ["SET_POINT_TEMPERATURE", "ACTUAL_TEMPERATURE", "LOW_BAT", "LEVEL", "ACTIVE_PROFILE"]
+# Domoticz calls onHeartbeat every 10 seconds until the plugin sets the heartbeat
+DEFAULTHEARTBEAT = 10
+
+# Simulated clock - real time plus an offset advanced by the driver
+class Clock:
+
+    def __init__(self):
+        self.Offset = 0.0
+        return
+
+    def time(self):
+        return _time.time() + self.Offset
+
+    def Advance(self, To):
+        Delta = To - self.time()
+        if Delta > 0:
+            self.Offset += Delta
+        return
+
+# Replaces the module time of a plugin instance - time() is taken from the simulated clock
+class TimeModule:
+
+    def __init__(self, Clock):
+        self.Clock = Clock
+        return
+
+    def time(self):
+        return self.Clock.time()
+
+    def __getattr__(self, Name):
+        return getattr(_time, Name)
+
+# A plugin instance (one hardware in Domoticz) with its devices, connections and statistics
+class Instance:
+
+    def __init__(self, Simulator, Parameters, Constants):
+        self.Simulator = Simulator
+        self.Parameters = Parameters
+        self.Constants = Constants
+        self.Devices = {}
+        self.Logs = []
+        self.Heartbeat = DEFAULTHEARTBEAT
+        self.LastHeartbeat = Simulator.Clock.time()
+        self.Heartbeats = 0
+        self.Started = False
+        self.Connections = []
+        # Commands waiting for the statechange response (command time) and the end-to-end latencies (seconds)
+        self.PendingCommands = []
+        self.CommandLatencies = []
+        # Requests send: (time, connection name, kind)
+        self.Sent = []
+        Domoticz.Runtime = self
+        Spec = importlib.util.spec_from_file_location("plugin_" + Parameters["HardwareID"], PLUGINFILE)
+        self.Module = importlib.util.module_from_spec(Spec)
+        Spec.loader.exec_module(self.Module)
+        self.Module.Devices = self.Devices
+        self.Module.Parameters = Parameters
+        self.Module.time = TimeModule(Simulator.Clock)
+        ## The instances of a simulator share the rate limit file in its home folder
+        self.Module.RATELIMITFOLDER = Simulator.HomeFolder
+        for Name, Value in Constants.items():
+            setattr(self.Module, Name, Value)
+        self.Plugin = self.Module._plugin
+        return
+
+    # Call a callback of the plugin, i.e. Call("onHeartbeat")
+    def Call(self, Name, *Args):
+        Domoticz.Runtime = self
+        return getattr(self.Module, Name)(*Args)
+
+    def Start(self):
+        self.LastHeartbeat = self.Simulator.Clock.time()
+        self.Started = True
+        self.Call("onStart")
+        return
+
+    def Stop(self):
+        self.Call("onStop")
+        self.Started = False
+        return
+
+    # Send a command as Domoticz does when a device is switched, i.e. Command(1, "Set Level", 21.5)
+    def Command(self, Unit, Command, Level=0):
+        self.PendingCommands.append(self.Simulator.Clock.time())
+        self.Call("onCommand", Unit, Command, Level, 0)
+        return
+
+    def AddLog(self, Level, Message):
+        self.Logs.append((self.Simulator.Clock.time(), Level, Message))
+        if self.Simulator.Verbose and Level != "Debug":
+            print(Level + " (" + self.Parameters["HardwareID"] + "): " + str(Message))
+        return
+
+    def Errors(self):
+        return [Message for _, Level, Message in self.Logs if Level == "Error"]
+
+    def SetHeartbeat(self, Interval):
+        self.Heartbeat = Interval
+        return
+
+    # Connection handling - called by the stand-in Domoticz.Connection
+    def Connect(self, Connection):
+        if Connection not in self.Connections:
+            Connection.Generation = 0
+            Connection.LastDue = 0
+            Connection.RequestCount = 0
+            self.Connections.append(Connection)
+        Connection.IsConnecting = True
+        self.Simulator.Schedule(self.Simulator.CCU.ConnectLatency, self.OnConnected, Connection, Connection.Generation)
+        return
+
+    def OnConnected(self, Connection, Generation):
+        if Generation != Connection.Generation or not Connection.IsConnecting:
+            return
+        Connection.IsConnecting = False
+        if self.Simulator.CCU.Refuse:
+            self.Call("onConnect", Connection, 111, "Connection refused")
+            return
+        Connection.IsConnected = True
+        Connection.RequestCount = 0
+        self.Call("onConnect", Connection, 0, "")
+        return
+
+    def Send(self, Connection, Message):
+        if not Connection.IsConnected:
+            self.AddLog("Error", "Harness: send on a closed connection " + Connection.Name)
+            return
+        Data = Message.get("Data", b"")
+        if isinstance(Data, str):
+            Data = Data.encode()
+        Now = self.Simulator.Clock.time()
+        Response = self.Simulator.CCU.Handle(Message.get("Verb", "GET"), Message.get("URL", "/"), Data)
+        Kind = "setValue" if b"Interface.setValue" in Data else Message.get("URL", "/").split("?")[0].rsplit("/", 1)[-1]
+        self.Sent.append((Now, Connection.Name, Kind))
+        if Response is None:
+            return
+        Connection.RequestCount += 1
+        Due = max(Now + self.Simulator.CCU.Latency, Connection.LastDue)
+        Connection.LastDue = Due
+        self.Simulator.ScheduleAt(Due, self.OnResponse, Connection, Connection.Generation, Response, Kind, Now)
+        return
+
+    def OnResponse(self, Connection, Generation, Response, Kind, SentTime):
+        if Generation != Connection.Generation:
+            return
+        self.Call("onMessage", Connection, {"Status": str(Response[0]), "Data": bytearray(Response[1]), "Headers": {}})
+        ## JSON-RPC errors are send with status 200, i.e. an expired session
+        if Kind in ("statechange.cgi", "setValue") and Response[0] == 200 and b'"error": {' not in Response[1]:
+            Now = self.Simulator.Clock.time()
+            self.CommandLatencies.extend([Now - CommandTime for CommandTime in self.PendingCommands if CommandTime <= SentTime])
+            self.PendingCommands = [CommandTime for CommandTime in self.PendingCommands if CommandTime > SentTime]
+        # The CCU closes the keep-alive connection after KeepAliveMax requests
+        KeepAliveMax = self.Simulator.CCU.KeepAliveMax
+        if KeepAliveMax and Connection.IsConnected and Connection.RequestCount >= KeepAliveMax:
+            self.Disconnect(Connection)
+        return
+
+    def Disconnect(self, Connection):
+        WasOpen = Connection.IsConnected or Connection.IsConnecting
+        Connection.IsConnected = False
+        Connection.IsConnecting = False
+        Connection.Generation = getattr(Connection, "Generation", 0) + 1
+        Connection.LastDue = 0
+        if WasOpen:
+            self.Simulator.Schedule(0, self.Call, "onDisconnect", Connection)
+        return
+
+    # Wait (real time) for the result of a worker thread, so the result is processed with the next callback as in Domoticz
+    def WaitWorker(self, Timeout=30):
+        Plugin = self.Plugin
+        if not getattr(Plugin, "WorkerPending", False):
+            return
+        Deadline = _time.time() + Timeout
+        while Plugin.WorkerResults.empty() and _time.time() < Deadline:
+            _time.sleep(0.001)
+        return
+
+    def Requests(self, Kind=None):
+        return len([Sent for Sent in self.Sent if Kind is None or Sent[2] == Kind])
+
+# The simulator with the stub CCU, the plugin instances and the event queue
+class Simulator:
+
+    def __init__(self, CCU=None, Seed=1, Verbose=False):
+        self.Clock = Clock()
+        self.CCU = CCU if CCU is not None else StubCCU()
+        self.CCU.Clock = self.Clock.time
+        self.Events = []
+        self.Sequence = itertools.count()
+        self.Instances = []
+        self.Verbose = Verbose
+        self.HomeFolder = tempfile.mkdtemp(prefix="hmip-etrv-harness-") + os.sep
+        random.seed(Seed)
+        return
+
+    def Now(self):
+        return self.Clock.time()
+
+    def Schedule(self, Delay, Function, *Args):
+        self.ScheduleAt(self.Clock.time() + Delay, Function, *Args)
+        return
+
+    def ScheduleAt(self, Time, Function, *Args):
+        heapq.heappush(self.Events, (Time, next(self.Sequence), Function, Args))
+        return
+
+    # Add a plugin instance for the device ids. The datapoints (Mode2) are taken from the stub CCU if Discover is False.
+    ## Constants: plugin constants to change, i.e. {"WORKERMODE": True}
+    def AddInstance(self, HardwareID, DeviceIDs, Mode5="60", Discover=False, Transport="", PushEvents="", Constants=None, Start=True, Address="127.0.0.1"):
+        Mode2 = ""
+        if not Discover:
+            Mode2 = ";".join([",".join(self.CCU.DevicesByID[DeviceID].DatapointIDs(DATAPOINTTYPES)) for DeviceID in DeviceIDs])
+        Parameters = {"Name": "Thermostat " + str(HardwareID), "Address": Address, "Port": "80", "HardwareID": str(HardwareID), "HomeFolder": self.HomeFolder,
+                      "Mode1": ",".join(DeviceIDs), "Mode2": Mode2, "Mode3": Transport, "Mode4": PushEvents, "Mode5": str(Mode5), "Mode6": "Normal",
+                      "Username": "harness", "Password": "harness", "Key": "HMIP-eTRV"}
+        instance = Instance(self, Parameters, Constants if Constants is not None else {})
+        self.Instances.append(instance)
+        if Start:
+            instance.Start()
+        return instance
+
+    # Restart a plugin instance as Domoticz does after the hardware settings are changed - the devices are kept
+    ## Changes: parameters to change, i.e. {"Mode2": ""}
+    def RestartInstance(self, instance, Changes=None):
+        if instance.Started:
+            instance.Stop()
+        Parameters = dict(instance.Parameters)
+        Parameters.update(Changes if Changes is not None else {})
+        restarted = Instance(self, Parameters, instance.Constants)
+        for Unit, Device in instance.Devices.items():
+            Device.Runtime = restarted
+            restarted.Devices[Unit] = Device
+        self.Instances[self.Instances.index(instance)] = restarted
+        restarted.Start()
+        return restarted
+
+    # Run the simulation for the duration (simulated seconds)
+    ## The events (connect, responses, scheduled calls) and the heartbeats of the instances are executed in time order
+    def Run(self, Duration):
+        End = self.Clock.time() + Duration
+        while True:
+            for instance in self.Instances:
+                if instance.Started:
+                    instance.WaitWorker()
+            Due = self.Events[0][0] if self.Events else None
+            Heartbeat = None
+            for instance in self.Instances:
+                if instance.Started and (Heartbeat is None or instance.LastHeartbeat + instance.Heartbeat < Heartbeat.LastHeartbeat + Heartbeat.Heartbeat):
+                    Heartbeat = instance
+            if Heartbeat is not None and (Due is None or Heartbeat.LastHeartbeat + Heartbeat.Heartbeat < Due):
+                Due = Heartbeat.LastHeartbeat + Heartbeat.Heartbeat
+            else:
+                Heartbeat = None
+            if Due is None or Due > End:
+                self.Clock.Advance(End)
+                return
+            self.Clock.Advance(Due)
+            if Heartbeat is not None:
+                Heartbeat.LastHeartbeat = self.Clock.time()
+                Heartbeat.Heartbeats += 1
+                Heartbeat.Call("onHeartbeat")
+            else:
+                _, _, Function, Args = heapq.heappop(self.Events)
+                Function(*Args)
+        return
+
+    # The CCU closes all connections, i.e. the CCU restarts
+    def CloseConnections(self):
+        for instance in self.Instances:
+            for Connection in instance.Connections:
+                instance.Disconnect(Connection)
+        return
+
+    def Stop(self):
+        for instance in self.Instances:
+            if instance.Started:
+                instance.Stop()
+        self.CCU.Shutdown()
+        return
+
+# Split the thermostats of the stub CCU into plugin instances of max ThermostatsPerInstance (see MAXTHERMOSTATS)
+def AddInstances(Simulator, ThermostatsPerInstance=15, FirstHardwareID=1, **Options):
+    DeviceIDs = [Device.DeviceID for Device in Simulator.CCU.Devices]
+    Instances = []
+    for Index, Start in enumerate(range(0, len(DeviceIDs), ThermostatsPerInstance)):
+        Instances.append(Simulator.AddInstance(FirstHardwareID + Index, DeviceIDs[Start:Start + ThermostatsPerInstance], **Options))
+    return Instances
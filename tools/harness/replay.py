@@ -0,0 +1,76 @@
+# Offline harness - replay benchmark for 1, 10 and 100 simulated thermostats
+# Replays a simulated period (default 1 hour) with temperature changes at the CCU and setpoint commands in Domoticz,
+# and reports per run: CCU requests, device updates, XML parse time and the end-to-end command latency
+# (onCommand to the statechange response, including the debounce window and the heartbeat).
+# More than 15 thermostats (MAXTHERMOSTATS) are split into multiple plugin instances.
+## Usage: python3 tools/harness/replay.py [--thermostats 1 10 100] [--duration 3600] [--latency 0.05] [--worker] [--transport JSON-RPC]
+import argparse
+import random
+import time
+
+from driver import Simulator, AddInstances
+from ccu import StubCCU
+
+def Replay(Thermostats, Duration, Latency, Worker, Transport, Seed):
+    CCU = StubCCU(Thermostats=Thermostats)
+    CCU.Latency = Latency
+    Sim = Simulator(CCU, Seed=Seed)
+    Address = CCU.Serve() if Worker else "127.0.0.1"
+    ## The rate limit is shared by all instances and would dominate the command latency of 100 thermostats
+    Constants = {"WORKERMODE": Worker, "RATELIMIT": 0}
+    Instances = AddInstances(Sim, Transport=Transport, Constants=Constants, Address=Address)
+    Workload = random.Random(Seed)
+    StartTime = time.time()
+    Elapsed = 0
+    # Every 5 minutes the temperature of a quarter of the thermostats changes, every 10 minutes a setpoint is changed in Domoticz
+    while Elapsed < Duration:
+        Sim.Run(300)
+        Elapsed += 300
+        for Index in Workload.sample(range(Thermostats), max(1, Thermostats // 4)):
+            CCU.Drift(Index, Workload.uniform(17, 23), Workload.uniform(0, 1))
+        if Elapsed % 600 == 0:
+            Index = Workload.randrange(Thermostats)
+            instance = Instances[Index // 15]
+            instance.Command((Index % 15) * 16 + 1, "Set Level", Workload.choice([18.0, 19.5, 21.0, 22.5]))
+    Sim.Run(60)
+    WallTime = time.time() - StartTime
+    Result = {"thermostats": Thermostats, "instances": len(Instances),
+              "requests": CCU.TotalRequests(), "requestsbykind": dict(CCU.Requests),
+              "deviceupdates": sum(instance.Plugin.DeviceUpdates for instance in Instances),
+              "parsetime": Combine([instance.Plugin.ParseTime for instance in Instances]),
+              "commands": sum(len(instance.CommandLatencies) for instance in Instances),
+              "commandlatency": Summary([Latency for instance in Instances for Latency in instance.CommandLatencies]),
+              "errors": sum(len(instance.Errors()) for instance in Instances),
+              "walltime": round(WallTime, 2)}
+    Sim.Stop()
+    return Result
+
+# Combine the plugin statistics (ms) of the instances
+def Combine(Statistics):
+    Count = sum(Statistic.Count for Statistic in Statistics)
+    Total = sum(Statistic.Total for Statistic in Statistics)
+    return {"n": Count, "avg": round(Total / Count, 3) if Count else 0.0, "max": round(max([Statistic.Max for Statistic in Statistics] + [0]), 3)}
+
+def Summary(Values):
+    return {"n": len(Values), "avg": round(sum(Values) / len(Values), 3) if Values else 0.0, "max": round(max(Values + [0]), 3)}
+
+def main():
+    Parser = argparse.ArgumentParser(description="Replay benchmark of the HmIP-eTRV plugin against a stub CCU")
+    Parser.add_argument("--thermostats", type=int, nargs="+", default=[1, 10, 100])
+    Parser.add_argument("--duration", type=int, default=3600, help="simulated seconds")
+    Parser.add_argument("--latency", type=float, default=0.05, help="CCU response latency (seconds)")
+    Parser.add_argument("--worker", action="store_true", help="worker mode (stub CCU served via HTTP)")
+    Parser.add_argument("--transport", default="", help="XML-API (default) or JSON-RPC")
+    Parser.add_argument("--seed", type=int, default=1)
+    Args = Parser.parse_args()
+    print("thermostats instances requests device-updates parse-ms(avg/max) commands latency-s(avg/max) errors wall-s")
+    for Thermostats in Args.thermostats:
+        Result = Replay(Thermostats, Args.duration, Args.latency, Args.worker, Args.transport, Args.seed)
+        print("%11d %9d %8d %14d %17s %8d %17s %6d %6.2f" % (Result["thermostats"], Result["instances"], Result["requests"], Result["deviceupdates"],
+              "%.3f/%.3f" % (Result["parsetime"]["avg"], Result["parsetime"]["max"]), Result["commands"],
+              "%.2f/%.2f" % (Result["commandlatency"]["avg"], Result["commandlatency"]["max"]), Result["errors"], Result["walltime"]))
+        print("  requests by kind: " + str(Result["requestsbykind"]))
+    return
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+# Offline harness - replay scenarios checking the behaviour of the plugin against the stub CCU
+# Each scenario returns a list of failed checks (empty = passed).
+## Usage: python3 tools/harness/scenarios.py [scenario ...]
+import os
+import sys
+
+from driver import Simulator
+from ccu import StubCCU
+
+SCENARIOS = {}
+
+def Scenario(Function):
+    SCENARIOS[Function.__name__] = Function
+    return Function
+
+def Check(Failures, Condition, Message):
+    if not Condition:
+        Failures.append(Message)
+    return
+
+# The first datapoints request at start creates and updates the devices of all thermostats
+@Scenario
+def startup():
+    Failures = []
+    Sim = Simulator(StubCCU(Thermostats=2))
+    instance = Sim.AddInstance(7, [Device.DeviceID for Device in Sim.CCU.Devices])
+    Sim.Run(120)
+    Check(Failures, len(instance.Devices) == 10, "devices created: " + str(len(instance.Devices)))
+    Check(Failures, instance.Devices[1].sValue == "20.0", "setpoint: " + instance.Devices[1].sValue)
+    Check(Failures, instance.Devices[2].sValue == "21.1", "temperature: " + instance.Devices[2].sValue)
+    Check(Failures, instance.Devices[17].sValue == "20.0", "setpoint 2nd thermostat: " + instance.Devices[17].sValue)
+    Check(Failures, not instance.Errors(), "errors: " + str(instance.Errors()))
+    Sim.Stop()
+    return Failures
+
+# A setpoint and a profile change within the debounce window are send with one statechange request
+@Scenario
+def command():
+    Failures = []
+    Sim = Simulator(StubCCU(Thermostats=1))
+    instance = Sim.AddInstance(7, [Sim.CCU.Devices[0].DeviceID])
+    Sim.Run(70)
+    instance.Command(1, "Set Level", 22.5)
+    instance.Command(5, "Set Level", 30)
+    Sim.Run(30)
+    Check(Failures, instance.Requests("statechange.cgi") == 1, "statechange requests: " + str(instance.Requests("statechange.cgi")))
+    Check(Failures, Sim.CCU.Devices[0].Datapoints["SET_POINT_TEMPERATURE"][3] == "22.5", "CCU setpoint: " + Sim.CCU.Devices[0].Datapoints["SET_POINT_TEMPERATURE"][3])
+    Check(Failures, instance.Devices[1].sValue == "22.5", "setpoint device: " + instance.Devices[1].sValue)
+    Check(Failures, instance.Devices[5].sValue == "30", "profile device: " + instance.Devices[5].sValue)
+    Check(Failures, len(instance.CommandLatencies) == 2, "commands confirmed: " + str(len(instance.CommandLatencies)))
+    Sim.Stop()
+    return Failures
+
+# Commands switch the heartbeat to 1 second within an interval - the datapoints are still requested every check interval (Mode5)
+@Scenario
+def schedule():
+    Failures = []
+    Sim = Simulator(StubCCU(Thermostats=1))
+    instance = Sim.AddInstance(7, [Sim.CCU.Devices[0].DeviceID], Constants={"POLLINTERVALMAX": 0})
+    Telemetry = []
+    Publish = instance.Plugin.PublishTelemetry
+    instance.Plugin.PublishTelemetry = lambda: (Telemetry.append(Sim.Now()), Publish())
+    Sim.Run(100)
+    for Index in range(20):
+        instance.Command(1, "Set Level", 20 + (Index % 2))
+        Sim.Run(120)
+    Start = Sim.Now() - 2400
+    Times = [Sent[0] for Sent in instance.Sent if Sent[2] == "state.cgi" and Sent[0] >= Start]
+    Gap = max([Next - Time for Time, Next in zip(Times, Times[1:])] + [0])
+    Check(Failures, Gap <= 61, "max time between datapoints requests: " + str(round(Gap)) + " s")
+    ## Telemetry every 300 s (TELEMETRYINTERVAL) in 2500 s
+    Check(Failures, len(Telemetry) == 8, "telemetry published: " + str(len(Telemetry)))
+    Sim.Stop()
+    return Failures
+
+# Refused connections open the circuit breaker - no requests are send while open
+@Scenario
+def refused():
+    Failures = []
+    Sim = Simulator(StubCCU(Thermostats=1))
+    instance = Sim.AddInstance(7, [Sim.CCU.Devices[0].DeviceID], Constants={"POLLINTERVALMAX": 0})
+    Sim.Run(70)
+    Sim.CCU.Refuse = True
+    Sim.CloseConnections()
+    Sim.Run(600)
+    Check(Failures, instance.Plugin.Breaker.State != "closed", "breaker: " + instance.Plugin.Breaker.ToString())
+    Sim.CCU.Refuse = False
+    Sim.Run(1800)
+    Check(Failures, instance.Plugin.Breaker.State == "closed", "breaker after recovery: " + instance.Plugin.Breaker.ToString())
+    Sim.Stop()
+    return Failures
+
+# A single failed connect (the breaker stays closed): the queued command is send with the next heartbeat, not with the next datapoints request
+@Scenario
+def reconnect():
+    Failures = []
+    Sim = Simulator(StubCCU(Thermostats=1))
+    instance = Sim.AddInstance(7, [Sim.CCU.Devices[0].DeviceID])
+    Sim.Run(1300)
+    Sim.CCU.Refuse = True
+    Sim.CloseConnections()
+    instance.Command(1, "Set Level", 22.5)
+    Sim.Run(10)
+    Sim.CCU.Refuse = False
+    Sim.Run(120)
+    Check(Failures, instance.Plugin.Breaker.Failures == 0, "breaker: " + instance.Plugin.Breaker.ToString())
+    Check(Failures, Sim.CCU.Devices[0].Datapoints["SET_POINT_TEMPERATURE"][3] == "22.5", "CCU setpoint: " + Sim.CCU.Devices[0].Datapoints["SET_POINT_TEMPERATURE"][3])
+    Check(Failures, len(instance.CommandLatencies) == 1 and instance.CommandLatencies[0] <= 70, "command latency: " + str(instance.CommandLatencies))
+    Sim.Stop()
+    return Failures
+
+# A value which can not be converted: the other datapoints of the thermostat are applied with the next response, not skipped as unchanged
+@Scenario
+def convert():
+    Failures = []
+    Sim = Simulator(StubCCU(Thermostats=1))
+    Device = Sim.CCU.Devices[0]
+    instance = Sim.AddInstance(7, [Device.DeviceID], Constants={"POLLINTERVALMAX": 0})
+    Sim.Run(70)
+    Device.SetValue("ACTUAL_TEMPERATURE", "n/a", Sim.Now())
+    Device.SetValue("LEVEL", "0.500000", Sim.Now())
+    Sim.Run(60)
+    Device.SetValue("ACTUAL_TEMPERATURE", "21.500000", Sim.Now())
+    Sim.Run(60)
+    Check(Failures, instance.Devices[2].sValue == "21.5", "temperature: " + instance.Devices[2].sValue)
+    Check(Failures, instance.Devices[4].sValue == "50.0", "valve level: " + instance.Devices[4].sValue)
+    Sim.Stop()
+    return Failures
+
+# The CCU accepts the requests but does not respond: the requests time out, the breaker opens and the held command is send after recovery
+@Scenario
+def hang():
+    Failures = []
+    Sim = Simulator(StubCCU(Thermostats=1))
+    instance = Sim.AddInstance(7, [Sim.CCU.Devices[0].DeviceID], Constants={"POLLINTERVALMAX": 0})
+    Sim.Run(70)
+    Sim.CCU.Hang = True
+    instance.Command(1, "Set Level", 22.5)
+    Sim.Run(600)
+    Check(Failures, instance.Plugin.Errors.get("timeout", 0) >= 1, "timeouts: " + str(instance.Plugin.Errors))
+    Check(Failures, instance.Plugin.Breaker.State != "closed", "breaker: " + instance.Plugin.Breaker.ToString())
+    Sim.CCU.Hang = False
+    Sim.Run(1800)
+    Check(Failures, instance.Plugin.Breaker.State == "closed", "breaker after recovery: " + instance.Plugin.Breaker.ToString())
+    Check(Failures, Sim.CCU.Devices[0].Datapoints["SET_POINT_TEMPERATURE"][3] == "22.5", "CCU setpoint: " + Sim.CCU.Devices[0].Datapoints["SET_POINT_TEMPERATURE"][3])
+    Sim.Stop()
+    return Failures
+
+# Warm start after correcting the datapoints (Mode2): the first response is applied with the corrected mapping, not skipped by the digest
+@Scenario
+def snapshotmode2():
+    Failures = []
+    Sim = Simulator(StubCCU(Thermostats=1))
+    Device = Sim.CCU.Devices[0]
+    instance = Sim.AddInstance(7, [Device.DeviceID])
+    Correct = instance.Parameters["Mode2"]
+    ## setpoint and actual temperature swapped
+    IDs = Correct.split(",")
+    instance = Sim.RestartInstance(instance, {"Mode2": ",".join([IDs[1], IDs[0]] + IDs[2:])})
+    Sim.Run(120)
+    instance = Sim.RestartInstance(instance, {"Mode2": Correct})
+    Sim.Run(120)
+    Check(Failures, instance.Devices[1].sValue == "20.0", "setpoint: " + instance.Devices[1].sValue)
+    Check(Failures, instance.Devices[2].sValue == "21.1", "temperature: " + instance.Devices[2].sValue)
+    Sim.Stop()
+    return Failures
+
+# Warm start without the datapoints cache: the datapoints are discovered again with the first response and commands are accepted
+@Scenario
+def snapshotdiscover():
+    Failures = []
+    Sim = Simulator(StubCCU(Thermostats=1))
+    instance = Sim.AddInstance(7, [Sim.CCU.Devices[0].DeviceID], Discover=True)
+    Sim.Run(120)
+    instance.Stop()
+    os.remove(Sim.HomeFolder + "datapoints_7.json")
+    instance = Sim.RestartInstance(instance)
+    Sim.Run(120)
+    Check(Failures, instance.Plugin.Thermostats[0].DatapointsList != [], "datapoints not discovered")
+    instance.Command(1, "Set Level", 22.5)
+    Sim.Run(30)
+    Check(Failures, Sim.CCU.Devices[0].Datapoints["SET_POINT_TEMPERATURE"][3] == "22.5", "CCU setpoint: " + Sim.CCU.Devices[0].Datapoints["SET_POINT_TEMPERATURE"][3])
+    Check(Failures, not instance.Errors(), "errors: " + str(instance.Errors()))
+    Sim.Stop()
+    return Failures
+
+# Optional datapoints: devices are only created for the datapoint types found (HUMIDITY is not a datapoint of the HmIP-eTRV-2)
+@Scenario
+def optional():
+    Failures = []
+    Sim = Simulator(StubCCU(Thermostats=1))
+    Constants = {"DATAPOINTTYPESOPTIONAL": ["BOOST_MODE", "WINDOW_STATE", "HUMIDITY"]}
+    instances = [Sim.AddInstance(7, [Sim.CCU.Devices[0].DeviceID], Discover=True, Constants=Constants),
+                 Sim.AddInstance(8, [Sim.CCU.Devices[0].DeviceID], Transport="JSON-RPC", Constants=Constants)]
+    Sim.Run(120)
+    for instance in instances:
+        Name = instance.Parameters["Mode3"] or "XML-API"
+        Check(Failures, sorted(instance.Devices) == [1, 2, 3, 4, 5, 6, 7], Name + " devices: " + str(sorted(instance.Devices)))
+        Check(Failures, 6 in instance.Devices and instance.Devices[6].sValue == "Off", Name + " boost device")
+        Check(Failures, not instance.Errors(), Name + " errors: " + str(instance.Errors()))
+        instance.Command(6, "On")
+    Sim.Run(30)
+    Check(Failures, Sim.CCU.Requests.get("Interface.setValue") == 1 and Sim.CCU.Requests.get("statechange.cgi") == 1,
+          "boost requests: " + str(Sim.CCU.Requests))
+    Check(Failures, Sim.CCU.Devices[0].Datapoints["BOOST_MODE"][3] == "true", "CCU boost: " + Sim.CCU.Devices[0].Datapoints["BOOST_MODE"][3])
+    Sim.Stop()
+    return Failures
+
+# Changed optional datapoint types: the cached datapoints are taken by type, not by position in the list
+@Scenario
+def optionalcache():
+    Failures = []
+    Sim = Simulator(StubCCU(Thermostats=1))
+    Device = Sim.CCU.Devices[0]
+    instance = Sim.AddInstance(7, [Device.DeviceID], Discover=True, Constants={"DATAPOINTTYPESOPTIONAL": ["BOOST_MODE", "WINDOW_STATE"]})
+    Sim.Run(120)
+    instance.Stop()
+    instance.Constants = {"DATAPOINTTYPESOPTIONAL": ["WINDOW_STATE"]}
+    instance = Sim.RestartInstance(instance)
+    Sim.Run(120)
+    Dispatch = instance.Plugin.Thermostats[0].Dispatch
+    Check(Failures, Dispatch.get(Device.Datapoints["WINDOW_STATE"][0], {}).get("Attribute") == "WindowState", "window datapoint: " + str(list(Dispatch)))
+    Check(Failures, Device.Datapoints["BOOST_MODE"][0] not in Dispatch, "boost datapoint dispatched: " + str(list(Dispatch)))
+    Check(Failures, not instance.Errors(), "errors: " + str(instance.Errors()))
+    Sim.Stop()
+    return Failures
+
+# JSON-RPC: login once, resolve the device address and get the values per channel
+@Scenario
+def jsonrpc():
+    Failures = []
+    Sim = Simulator(StubCCU(Thermostats=2))
+    instance = Sim.AddInstance(7, [Device.DeviceID for Device in Sim.CCU.Devices], Transport="JSON-RPC")
+    Sim.Run(200)
+    Check(Failures, Sim.CCU.Requests.get("Session.login") == 1, "logins: " + str(Sim.CCU.Requests.get("Session.login")))
+    Check(Failures, instance.Devices[2].sValue == "21.1", "temperature: " + instance.Devices[2].sValue)
+    instance.Command(1, "Set Level", 19.5)
+    Sim.Run(30)
+    Check(Failures, Sim.CCU.Devices[0].Datapoints["SET_POINT_TEMPERATURE"][3] == "19.500000", "CCU setpoint: " + Sim.CCU.Devices[0].Datapoints["SET_POINT_TEMPERATURE"][3])
+    Check(Failures, not instance.Errors(), "errors: " + str(instance.Errors()))
+    Sim.Stop()
+    return Failures
+
+# JSON-RPC: the session expired - the setpoint is send again after the new login
+@Scenario
+def jsonrpcsession():
+    Failures = []
+    Sim = Simulator(StubCCU(Thermostats=1))
+    instance = Sim.AddInstance(7, [Sim.CCU.Devices[0].DeviceID], Transport="JSON-RPC")
+    Sim.Run(120)
+    Sim.CCU.ExpireSessions()
+    instance.Command(1, "Set Level", 19.5)
+    Sim.Run(30)
+    Check(Failures, Sim.CCU.Requests.get("Session.login") == 2, "logins: " + str(Sim.CCU.Requests.get("Session.login")))
+    Check(Failures, Sim.CCU.Devices[0].Datapoints["SET_POINT_TEMPERATURE"][3] == "19.500000", "CCU setpoint: " + Sim.CCU.Devices[0].Datapoints["SET_POINT_TEMPERATURE"][3])
+    Sim.Stop()
+    return Failures
+
+# JSON-RPC errors other than an expired session (unknown device id, null result) drop the request without a new login
+@Scenario
+def jsonrpcerror():
+    Failures = []
+    Sim = Simulator(StubCCU(Thermostats=1))
+    instance = Sim.AddInstance(7, [Sim.CCU.Devices[0].DeviceID, "9999"], Discover=True, Transport="JSON-RPC")
+    Sim.Run(120)
+    Check(Failures, Sim.CCU.Requests.get("Session.login") == 1, "logins: " + str(Sim.CCU.Requests.get("Session.login")))
+    Check(Failures, instance.Devices[2].sValue == "21.1", "temperature: " + instance.Devices[2].sValue)
+    Sim.CCU.NullResults = {"Interface.getParamset"}
+    Sim.Run(120)
+    Sim.CCU.NullResults = set()
+    instance.Command(1, "Set Level", 19.5)
+    Sim.Run(30)
+    Check(Failures, Sim.CCU.Requests.get("Session.login") == 1, "logins: " + str(Sim.CCU.Requests.get("Session.login")))
+    Check(Failures, Sim.CCU.Devices[0].Datapoints["SET_POINT_TEMPERATURE"][3] == "19.500000", "CCU setpoint: " + Sim.CCU.Devices[0].Datapoints["SET_POINT_TEMPERATURE"][3])
+    Sim.Stop()
+    return Failures
+
+# Worker mode: the datapoints are requested once per check interval (Mode5), not with every 1 second heartbeat
+@Scenario
+def worker():
+    Failures = []
+    Sim = Simulator(StubCCU(Thermostats=1))
+    Address = Sim.CCU.Serve()
+    instance = Sim.AddInstance(7, [Sim.CCU.Devices[0].DeviceID], Address=Address, Constants={"WORKERMODE": True, "POLLINTERVALMAX": 0})
+    Sim.Run(600)
+    Requests = Sim.CCU.Requests.get("state.cgi", 0)
+    Check(Failures, 10 <= Requests <= 12, "state.cgi requests in 600 s: " + str(Requests))
+    Check(Failures, instance.Devices[2].sValue == "21.1", "temperature: " + instance.Devices[2].sValue)
+    Check(Failures, not instance.Errors(), "errors: " + str(instance.Errors()))
+    Sim.Stop()
+    return Failures
+
+# Phase offset: instances with consecutive hardware ids request the datapoints in different seconds, starting with the offset
+@Scenario
+def phase():
+    Failures = []
+    Sim = Simulator(StubCCU(Thermostats=2))
+    instances = [Sim.AddInstance(HardwareID, [Sim.CCU.Devices[Index].DeviceID], Constants={"POLLINTERVALMAX": 0}) for Index, HardwareID in enumerate([7, 8])]
+    Start = Sim.Now()
+    Sim.Run(240)
+    Times = [[round(Sent[0] - Start) for Sent in instance.Sent if Sent[2] == "state.cgi"] for instance in instances]
+    Check(Failures, Times[0][:4] == [49, 109, 169, 229], "poll times hardware id 7: " + str(Times[0]))
+    Check(Failures, Times[1][:4] == [56, 116, 176, 236], "poll times hardware id 8: " + str(Times[1]))
+    Sim.Stop()
+    return Failures
+
+# The peak concurrent requests is measured per run: after restarting with the phase offset the lower peak is logged
+@Scenario
+def peak():
+    Failures = []
+    Sim = Simulator(StubCCU(Thermostats=3))
+    Sim.CCU.Latency = 0.3
+    instances = [Sim.AddInstance(HardwareID, [Sim.CCU.Devices[HardwareID - 1].DeviceID], Constants={"PHASEOFFSETSTEP": 0}) for HardwareID in [1, 2, 3]]
+    Sim.Run(300)
+    Before = max(instance.Plugin.PeakRequestsInFlight for instance in instances)
+    for instance in instances:
+        instance.Constants = {"PHASEOFFSETSTEP": 7}
+    instances = [Sim.RestartInstance(instance) for instance in instances]
+    Sim.Run(300)
+    After = max(instance.Plugin.PeakRequestsInFlight for instance in instances)
+    Check(Failures, Before == 2 and After == 1, "peak concurrent requests without / with phase offset: " + str(Before) + " / " + str(After))
+    Sim.Stop()
+    return Failures
+
+def main():
+    Names = sys.argv[1:] if len(sys.argv) > 1 else list(SCENARIOS)
+    Failed = 0
+    for Name in Names:
+        Failures = SCENARIOS[Name]()
+        print(("PASS " if not Failures else "FAIL ") + Name + "".join(["\n     " + Failure for Failure in Failures]))
+        Failed += 1 if Failures else 0
+    sys.exit(1 if Failed else 0)
+
+if __name__ == "__main__":
+    main()